@@ -5,6 +5,8 @@ from __future__ import annotations
 import json
 import os
 import random
+import time
+from collections import OrderedDict
 from pathlib import Path
 import logging
 
@@ -25,6 +27,11 @@ except Exception:  # noqa: BLE001
 
 _llm_model = os.getenv("OPENAI_LLM_MODEL", "gpt-3.5-turbo")
 
+# Recently generated facts by (country, excluded fact), oldest first.
+_LLM_CACHE_TTL = 3600.0
+_LLM_CACHE_SIZE = 512
+_llm_cache: OrderedDict[tuple[str, str], tuple[float, str]] = OrderedDict()
+
 
 def get_static_fact(country: str) -> str:
     """Return a random fact for ``country`` prefixed with ``Интересный факт:``."""
@@ -38,9 +45,18 @@ async def generate_llm_fact(country: str, exclude: str) -> str:
     """Generate an additional fact about ``country`` avoiding ``exclude``.
 
     The returned string is trimmed to 150 characters. Any errors during the
-    API call result in a fallback message.
+    API call result in a fallback message. Successful answers are reused for
+    the same arguments for an hour.
     """
 
+    key = (country, exclude)
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        if time.monotonic() - cached[0] < _LLM_CACHE_TTL:
+            _llm_cache.move_to_end(key)
+            return cached[1]
+        del _llm_cache[key]
+
     prompt = (
         f"Сообщи один интересный факт о стране {country}. "
         f"Не повторяй этот факт: {exclude}. "
@@ -69,8 +85,11 @@ async def generate_llm_fact(country: str, exclude: str) -> str:
             )
         else:
             text = str(content)
-        text = text.strip().replace("\n", " ")
-        return text[:150]
+        text = text.strip().replace("\n", " ")[:150]
+        _llm_cache[key] = (time.monotonic(), text)
+        if len(_llm_cache) > _LLM_CACHE_SIZE:
+            _llm_cache.popitem(last=False)
+        return text
     except Exception as e:  # noqa: BLE001
         logger.warning("LLM fact generation failed: %s", e)
         return "Факт недоступен"
@@ -277,3 +277,13 @@ def get_flag_image_path(country: str) -> Path | None:
 
     path = FLAGS_DIR / f"{code.lower()}_flag.png"
     return path if path.exists() else None
+
+
+@lru_cache(maxsize=256)
+def read_flag_image(path: str) -> bytes:
+    """Return the contents of the flag image at ``path``.
+
+    Results are cached so every flag is read from disk at most once.
+    """
+
+    return Path(path).read_bytes()
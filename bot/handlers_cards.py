@@ -26,6 +26,7 @@ from .keyboards import (
 from .flags import get_country_flag, get_flag_image_path
 from .handlers_menu import WELCOME, ADMIN_ID
 from .facts import get_static_fact, generate_llm_fact
+from .ratelimit import limiter
 from .subsets import (
     cleanup_preview_messages,
     select_countries_by_letter,
@@ -76,7 +77,8 @@ async def _next_card(
         return
 
     is_last = len(session.queue) == 1
-    raw = session.queue.pop(0)
+    # The queue is shuffled, so taking from the end avoids shifting the list.
+    raw = session.queue.pop()
     if isinstance(raw, tuple):
         country, direction = raw
         item = (
@@ -97,33 +99,37 @@ async def _next_card(
     session.stats["shown"] += 1
     session.current_answered = False
 
-    logger.debug(
-        "Generated card question for user %s: %s -> %s",
-        session.user_id,
-        question["prompt"],
-        question["answer"],
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Generated card question for user %s: %s -> %s",
+            session.user_id,
+            question["prompt"],
+            question["answer"],
+        )
 
+    keyboard = cards_kb(question["options"])
     if update.callback_query and replace_message and not is_last:
         q = update.callback_query
         try:
-            await q.edit_message_text(
-                question["prompt"],
-                reply_markup=cards_kb(question["options"]),
-                parse_mode="HTML",
-            )
+            async with limiter.acquire(update.effective_chat.id):
+                await q.edit_message_text(
+                    question["prompt"],
+                    reply_markup=keyboard,
+                    parse_mode="HTML",
+                )
         except (TelegramError, HTTPError) as e:
             logger.warning("Failed to send card: %s", e)
             return
     else:
         chat_id = update.effective_chat.id
         try:
-            await context.bot.send_message(
-                chat_id,
-                question["prompt"],
-                reply_markup=cards_kb(question["options"]),
-                parse_mode="HTML",
-            )
+            async with limiter.acquire(chat_id):
+                await context.bot.send_message(
+                    chat_id,
+                    question["prompt"],
+                    reply_markup=keyboard,
+                    parse_mode="HTML",
+                )
         except (TelegramError, HTTPError) as e:
             logger.warning("Failed to send card: %s", e)
             return
@@ -182,25 +188,254 @@ async def _finish_session(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     chat_id = update.effective_chat.id
     try:
-        await context.bot.send_message(chat_id, text, reply_markup=reply_markup)
+        async with limiter.acquire(chat_id):
+            await context.bot.send_message(chat_id, text, reply_markup=reply_markup)
     except (TelegramError, HTTPError) as e:
         logger.warning("Failed to send session results: %s", e)
         return
 
 
+def _current_item(current: dict) -> str:
+    """Return the item tracked in stats for ``current`` (country or capital)."""
+
+    if current["type"] == "country_to_capital":
+        return current["country"]
+    return current["capital"]
+
+
+async def _send_fact(
+    q,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    country: str,
+    text: str,
+) -> None:
+    """Send ``text`` with a fact about ``country`` and the flag if available."""
+
+    fact = get_static_fact(country)
+    fact_msg = (
+        f"{text}\n\n{fact}\n\nНажми кнопку ниже, чтобы узнать еще один факт"
+    )
+    flag_path = get_flag_image_path(country)
+    msg = None
+    if flag_path:
+        try:
+            async with limiter.acquire(q.message.chat_id):
+                with flag_path.open("rb") as flag_file:
+                    msg = await context.bot.send_photo(
+                        q.message.chat_id,
+                        flag_file,
+                        caption=fact_msg,
+                        reply_markup=fact_more_kb(prefix="cards"),
+                    )
+        except (TelegramError, HTTPError) as e:
+            logger.warning("Failed to send flag image: %s", e)
+    else:
+        try:
+            async with limiter.acquire(q.message.chat_id):
+                msg = await context.bot.send_message(
+                    q.message.chat_id,
+                    fact_msg,
+                    reply_markup=fact_more_kb(prefix="cards"),
+                )
+        except (TelegramError, HTTPError) as e:
+            logger.warning("Failed to send card feedback: %s", e)
+    if msg:
+        session.fact_message_id = msg.message_id
+        session.fact_subject = country
+        session.fact_text = fact
+
+
+async def _handle_opt(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Check the chosen option and send feedback for the current card."""
+
+    q = update.callback_query
+    current = session.current
+    await q.answer()
+    index = int(parts[2])
+    item = _current_item(current)
+    selected = current["options"][index]
+    try:
+        async with limiter.acquire(q.message.chat_id):
+            await q.edit_message_reply_markup(None)
+    except (TelegramError, HTTPError) as e:
+        logger.warning("Failed to clear card buttons: %s", e)
+    if selected == current["answer"]:
+        if item not in session.unknown_set:
+            get_user_stats(context.user_data).to_repeat.discard(item)
+            session.stats["known"] += 1
+        text = (
+            f"✅ Верно\n{current['country']}"
+            f"\nСтолица: {current['capital']}"
+        )
+        await _send_fact(q, context, session, current["country"], text)
+    else:
+        session.unknown_set.add(item)
+        add_to_repeat(context.user_data, {item})
+        try:
+            async with limiter.acquire(q.message.chat_id):
+                await context.bot.send_message(
+                    q.message.chat_id,
+                    (
+                        "❌ <b>Неверно</b>."
+                        f"\n\nПравильный ответ:\n<b>{current['answer']}</b>"
+                    ),
+                    parse_mode="HTML",
+                )
+        except (TelegramError, HTTPError) as e:
+            logger.warning("Failed to send card feedback: %s", e)
+    session.current_answered = True
+    await asyncio.sleep(5)
+    await _next_card(update, context, replace_message=False)
+
+
+async def _handle_more_fact(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Append an LLM-generated fact to the last fact message."""
+
+    q = update.callback_query
+    await q.answer()
+    if session.fact_message_id != q.message.message_id:
+        return
+    extra = await generate_llm_fact(
+        session.fact_subject or "",
+        session.fact_text or "",
+    )
+    base = q.message.caption or q.message.text or ""
+    base = base.replace(
+        "\n\nНажми кнопку ниже, чтобы узнать еще один факт", ""
+    )
+    try:
+        async with limiter.acquire(q.message.chat_id):
+            if q.message.photo:
+                await q.edit_message_caption(
+                    caption=f"{base}\n\nЕще один факт: {extra}", reply_markup=None
+                )
+            else:
+                await q.edit_message_text(
+                    f"{base}\n\nЕще один факт: {extra}", reply_markup=None
+                )
+    except (TelegramError, HTTPError) as e:
+        logger.warning("Failed to send extra fact: %s", e)
+    session.fact_message_id = None
+
+
+async def _handle_show(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Reveal the answer for the current card and move on."""
+
+    q = update.callback_query
+    current = session.current
+    await q.answer()
+    item = _current_item(current)
+    session.unknown_set.add(item)
+    add_to_repeat(context.user_data, {item})
+    try:
+        async with limiter.acquire(q.message.chat_id):
+            await q.edit_message_reply_markup(None)
+    except (TelegramError, HTTPError) as e:
+        logger.warning("Failed to clear card buttons: %s", e)
+    text = f"{current['country']}\nСтолица: {current['capital']}"
+    await _send_fact(q, context, session, current["country"], text)
+    session.current_answered = True
+    await asyncio.sleep(5)
+    await _next_card(update, context, replace_message=False)
+
+
+async def _handle_next(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Show the next card."""
+
+    await update.callback_query.answer()
+    await _next_card(update, context)
+
+
+async def _handle_skip(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Mark the current card as unknown and show the next one."""
+
+    current = session.current
+    await update.callback_query.answer()
+    item = _current_item(current)
+    session.unknown_set.add(item)
+    add_to_repeat(context.user_data, {item})
+    session.current_answered = True
+    await _next_card(update, context)
+
+
+async def _handle_finish(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Finish the session on user request."""
+
+    await update.callback_query.answer()
+    await _finish_session(update, context)
+
+
+async def _handle_repeat(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CardSession,
+    parts: list[str],
+) -> None:
+    """Restart the session with the cards answered incorrectly."""
+
+    await update.callback_query.answer()
+    if not session.unknown_set:
+        return
+    session.queue = list(session.unknown_set)
+    random.shuffle(session.queue)
+    session.unknown_set.clear()
+    session.stats = {"shown": 0, "known": 0}
+    await _next_card(update, context)
+
+
+# Session-phase callbacks keyed by the action part of ``cards:<action>``.
+_SESSION_ACTIONS = {
+    "more_fact": _handle_more_fact,
+    "show": _handle_show,
+    "next": _handle_next,
+    "skip": _handle_skip,
+    "finish": _handle_finish,
+    "repeat": _handle_repeat,
+}
+
+
 async def cb_cards(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle all ``^cards:`` callbacks."""
 
     q = update.callback_query
+    data = q.data
 
-    parts = q.data.split(":")
-    action = parts[1] if len(parts) > 1 else ""
-
-    if parts == ["cards", "void"]:
+    if data == "cards:void":
         await q.answer()
         return
 
-    if action == "menu":
+    if data == "cards:menu":
         await q.answer()
         await cleanup_preview_messages(update, context, "card", q.message.message_id)
         context.user_data.pop("card_session", None)
@@ -217,6 +452,8 @@ async def cb_cards(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.warning("Failed to return to menu: %s", e)
         return
 
+    parts = data.split(":", 3)
+    action = parts[1] if len(parts) > 1 else ""
     setup: dict | None = context.user_data.get("card_setup")
 
     if action == "back":
@@ -485,191 +722,15 @@ async def cb_cards(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.warning("Failed to notify missing session: %s", e)
         return
 
-    current = session.current
-
-    if len(parts) == 3 and parts[1] == "opt":
-        await q.answer()
-        index = int(parts[2])
-        item = (
-            current["country"]
-            if current["type"] == "country_to_capital"
-            else current["capital"]
-        )
-        selected = current["options"][index]
-        if selected == current["answer"]:
-            if item not in session.unknown_set:
-                get_user_stats(context.user_data).to_repeat.discard(item)
-                session.stats["known"] += 1
-            fact = get_static_fact(current["country"])
-            text = (
-                f"✅ Верно\n{current['country']}"
-                f"\nСтолица: {current['capital']}"
-            )
-            fact_msg = (
-                f"{text}\n\n{fact}\n\nНажми кнопку ниже, чтобы узнать еще один факт"
-            )
-            flag_path = get_flag_image_path(current["country"])
-            try:
-                await q.edit_message_reply_markup(None)
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to clear card buttons: %s", e)
-            msg = None
-            if flag_path:
-                try:
-                    with flag_path.open("rb") as flag_file:
-                        msg = await context.bot.send_photo(
-                            q.message.chat_id,
-                            flag_file,
-                            caption=fact_msg,
-                            reply_markup=fact_more_kb(prefix="cards"),
-                        )
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to send flag image: %s", e)
-            else:
-                try:
-                    msg = await context.bot.send_message(
-                        q.message.chat_id,
-                        fact_msg,
-                        reply_markup=fact_more_kb(prefix="cards"),
-                    )
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to send card feedback: %s", e)
-            if msg:
-                session.fact_message_id = msg.message_id
-                session.fact_subject = current["country"]
-                session.fact_text = fact
-        else:
-            session.unknown_set.add(item)
-            add_to_repeat(context.user_data, {item})
-            try:
-                await q.edit_message_reply_markup(None)
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to clear card buttons: %s", e)
-            try:
-                await context.bot.send_message(
-                    q.message.chat_id,
-                    (
-                        "❌ <b>Неверно</b>."
-                        f"\n\nПравильный ответ:\n<b>{current['answer']}</b>"
-                    ),
-                    parse_mode="HTML",
-                )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send card feedback: %s", e)
-        session.current_answered = True
-        await asyncio.sleep(5)
-        await _next_card(update, context, replace_message=False)
-        return
-
-    action = parts[1]
-    if action == "more_fact":
-        await q.answer()
-        if session.fact_message_id != q.message.message_id:
-            return
-        extra = await generate_llm_fact(
-            session.fact_subject or "",
-            session.fact_text or "",
-        )
-        base = q.message.caption or q.message.text or ""
-        base = base.replace(
-            "\n\nНажми кнопку ниже, чтобы узнать еще один факт", ""
-        )
-        try:
-            if q.message.photo:
-                await q.edit_message_caption(
-                    caption=f"{base}\n\nЕще один факт: {extra}", reply_markup=None
-                )
-            else:
-                await q.edit_message_text(
-                    f"{base}\n\nЕще один факт: {extra}", reply_markup=None
-                )
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to send extra fact: %s", e)
-        session.fact_message_id = None
-        return
-
-    if action == "show":
-        await q.answer()
-        item = (
-            current["country"]
-            if current["type"] == "country_to_capital"
-            else current["capital"]
-        )
-        session.unknown_set.add(item)
-        add_to_repeat(context.user_data, {item})
-        try:
-            await q.edit_message_reply_markup(None)
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to clear card buttons: %s", e)
-        text = f"{current['country']}\nСтолица: {current['capital']}"
-        fact = get_static_fact(current["country"])
-        fact_msg = (
-            f"{text}\n\n{fact}\n\nНажми кнопку ниже, чтобы узнать еще один факт"
-        )
-        flag_path = get_flag_image_path(current["country"])
-        msg = None
-        if flag_path:
-            try:
-                with flag_path.open("rb") as flag_file:
-                    msg = await context.bot.send_photo(
-                        q.message.chat_id,
-                        flag_file,
-                        caption=fact_msg,
-                        reply_markup=fact_more_kb(prefix="cards"),
-                    )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send flag image: %s", e)
-        else:
-            try:
-                msg = await context.bot.send_message(
-                    q.message.chat_id,
-                    fact_msg,
-                    reply_markup=fact_more_kb(prefix="cards"),
-                )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send card feedback: %s", e)
-        if msg:
-            session.fact_message_id = msg.message_id
-            session.fact_subject = current["country"]
-            session.fact_text = fact
-        session.current_answered = True
-        await asyncio.sleep(5)
-        await _next_card(update, context, replace_message=False)
-        return
-
-    if action == "next":
-        await q.answer()
-        await _next_card(update, context)
-        return
-
-    if action == "skip":
-        await q.answer()
-        item = (
-            current["country"]
-            if current["type"] == "country_to_capital"
-            else current["capital"]
-        )
-        session.unknown_set.add(item)
-        add_to_repeat(context.user_data, {item})
-        session.current_answered = True
-        await _next_card(update, context)
-        return
-
-    if action == "finish":
-        await q.answer()
-        await _finish_session(update, context)
+    if action == "opt" and len(parts) == 3:
+        await _handle_opt(update, context, session, parts)
         return
 
-    if action == "repeat" and session.unknown_set:
+    handler = _SESSION_ACTIONS.get(action)
+    if handler is None:
         await q.answer()
-        session.queue = list(session.unknown_set)
-        random.shuffle(session.queue)
-        session.unknown_set.clear()
-        session.stats = {"shown": 0, "known": 0}
-        await _next_card(update, context)
         return
-
-    await q.answer()
+    await handler(update, context, session, parts)
 
 
 async def msg_cards_letter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -6,21 +6,32 @@ import asyncio
 import html
 import os
 import random
-import uuid
+import secrets
 import logging
+from datetime import timedelta
+from functools import lru_cache
 from io import BytesIO
-from collections.abc import Mapping, MutableMapping
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable, Mapping, MutableMapping
 from types import SimpleNamespace
 from html import escape
 
 from telegram import (
+    CallbackQuery,
     Update,
     ReplyKeyboardRemove,
     Chat,
     User,
 )
+from telegram.constants import ChatAction
 from telegram.ext import ContextTypes
-from telegram.error import BadRequest, TelegramError
+from telegram.error import (
+    BadRequest,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+    TimedOut,
+)
 from httpx import HTTPError
 
 from app import DATA
@@ -34,8 +45,9 @@ from .keyboards import (
     coop_fact_more_kb,
     coop_finish_kb,
 )
-from .flags import get_flag_image_path
+from .flags import get_flag_image_path, read_flag_image
 from .facts import get_static_fact, generate_llm_fact
+from .ratelimit import limiter
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +75,54 @@ BOT_TEAM_GENITIVE_NAMES = {
 # Probability of the bot answering correctly in the cooperative mode.
 BOT_BASE_ACCURACY = 0.9
 
+# Reply keyboard button that asks the bot for an invite link.
+_CREATE_LINK_CF = "создать ссылку".casefold()
+
+# Appended to fact messages that carry the "more facts" button.
+_MORE_FACT_HINT = "\n\nНажми кнопку ниже, чтобы узнать еще один факт"
+
+# Telegram file ids of flag images that were already uploaded, by file path.
+_FLAG_FILE_IDS: dict[str, str] = {}
+
+# Question directions drawn for every country at game start.
+QUESTION_MODES = ("country_to_capital", "capital_to_country")
+
+# Invitation sent to a shared contact and the deep link offered instead.
+INVITE_TEMPLATE = (
+    "{name} приглашает вас присоединиться к кооперативной игре "
+    "«Столицы мира». Нажмите кнопку, чтобы вступить."
+)
+INVITE_LINK_TEMPLATE = "https://t.me/{bot}?start=coop_{session_id}"
+
+# Scoreboard sent after every full round and the final result of a match.
+SCORE_TEMPLATE = (
+    "📊 <b>Текущий счёт</b>\n"
+    "🤝 Команда {team} — <b>{team_score}</b>\n"
+    "🤖 {bots} — <b>{bot_score}</b>\n"
+    "{remaining}"
+)
+FINAL_TEMPLATE = (
+    "🏁 <b>Игра завершена!</b>\n"
+    "🤝 Команда {team} — <b>{team_score}</b>\n"
+    "🤖 {bots} — <b>{bot_score}</b>\n\n"
+    "{result}"
+)
+
+# Intro sent to both players before the first question of a match.
+INTRO_TEMPLATE = (
+    "🌍 <b>Кооперативный матч начинается!</b>\n\n"
+    "Команда людей: вы и ваш напарник. Вместе вы бросаете вызов дуэту ботов!\n"
+    "🤖 <b>Команда соперников:</b> Бот Атлас и Бот Глобус — неутомимые проводники по миру столиц.\n\n"
+    "📦 Всего вопросов: <b>{total}</b>.\n"
+    "🔁 Порядок ходов:\n"
+    "   1️⃣ Игрок 1\n"
+    "   2️⃣ Бот Атлас\n"
+    "   3️⃣ Игрок 2\n"
+    "   4️⃣ Бот Глобус\n\n"
+    "🎯 Чтобы победить, наберите больше очков, чем команда ботов. При равенстве объявляется ничья.\n"
+    "🚀 Готовы? Первый вопрос появится уже через пару секунд!"
+)
+
 # Timing configuration for cooperative games (in seconds).
 FIRST_TURN_DELAY = 8
 TURN_TRANSITION_DELAY = 4
@@ -108,6 +168,30 @@ def _iter_session_maps(
     return mappings
 
 
+def _iter_player_session_maps(
+    context: ContextTypes.DEFAULT_TYPE, session: CoopSession
+) -> list[MutableMapping[str, CoopSession]]:
+    """Return the session mappings of the current chat and the players' chats."""
+
+    mappings: list[MutableMapping[str, CoopSession]] = []
+    sources: list[object] = [getattr(context, "chat_data", None)]
+    application = getattr(context, "application", None)
+    app_chat_data = getattr(application, "chat_data", None)
+    if isinstance(app_chat_data, Mapping):
+        sources.extend(
+            app_chat_data.get(chat_id) for chat_id in session.player_chats.values()
+        )
+    for source in sources:
+        if not isinstance(source, Mapping):
+            continue
+        sessions = source.get("sessions")
+        if isinstance(sessions, MutableMapping) and all(
+            sessions is not seen for seen in mappings
+        ):
+            mappings.append(sessions)
+    return mappings
+
+
 def _participant_key(participant: int | str) -> str:
     """Return a stable key for storing participant-specific data."""
 
@@ -125,23 +209,35 @@ def _get_participant_display_name(
 ) -> str:
     """Return a human-readable participant name for prompts."""
 
-    if _is_bot_participant(participant):
-        return BOT_TEAM_NAMES.get(participant, "Бот")
+    bot_name = BOT_TEAM_NAMES.get(participant)
+    if bot_name is not None:
+        return bot_name
 
     name = session.player_names.get(participant)
     if name:
         return name
 
     if isinstance(participant, int):
-        try:
-            index = session.players.index(participant)
-        except ValueError:
-            return str(participant)
+        index = session._player_index.get(participant)
+        if index is None or index >= len(session.players) or (
+            session.players[index] != participant
+        ):
+            try:
+                index = session.players.index(participant)
+            except ValueError:
+                return str(participant)
         return f"Игрок {index + 1}"
 
     return str(participant)
 
 
+def _add_player(session: CoopSession, user_id: int) -> None:
+    """Append ``user_id`` to the players of ``session``."""
+
+    session.players.append(user_id)
+    session._turn_setup_done = False
+
+
 def _build_turn_order(players: list[int]) -> list[int | str]:
     """Return the default turn order for the given players."""
 
@@ -158,6 +254,10 @@ def _build_turn_order(players: list[int]) -> list[int | str]:
 def _ensure_turn_setup(session: CoopSession) -> None:
     """Populate bot team and turn order if they are missing."""
 
+    if session._turn_setup_done and len(session.turn_order) == len(
+        session.players
+    ) + len(session.bot_team):
+        return
     if not session.bot_team:
         session.bot_team = [
             BotParticipant(identifier=identifier, name=BOT_TEAM_NAMES[identifier])
@@ -165,23 +265,25 @@ def _ensure_turn_setup(session: CoopSession) -> None:
         ]
     if not session.turn_order:
         session.turn_order = _build_turn_order(session.players)
-    if session.turn_order:
-        session.turn_index %= len(session.turn_order)
+    # Both lists are non-empty here: the bot team is always filled above and
+    # the turn order always contains the bots.
+    session.turn_index %= len(session.turn_order)
     for pid in session.players:
         session.player_stats.setdefault(pid, 0)
-    if session.bot_team:
-        session.bot_turn_index %= len(session.bot_team)
-    else:
-        session.bot_turn_index = 0
+    session.bot_turn_index %= len(session.bot_team)
+    session._bot_member_index = {
+        member.identifier: member for member in session.bot_team
+    }
+    session._player_index = {pid: index for index, pid in enumerate(session.players)}
+    session._team_label_html = escape(_format_team_label(session))
+    session._turn_setup_done = True
 
 
 def _get_bot_member(session: CoopSession, identifier: str) -> BotParticipant | None:
     """Return a bot participant instance by its identifier."""
 
-    for member in session.bot_team:
-        if member.identifier == identifier:
-            return member
-    return None
+    _ensure_turn_setup(session)
+    return session._bot_member_index.get(identifier)
 
 
 def _get_current_participant(session: CoopSession) -> int | str | None:
@@ -195,11 +297,73 @@ def _get_current_participant(session: CoopSession) -> int | str | None:
     return session.turn_order[index]
 
 
+def _get_bot_data(
+    context: ContextTypes.DEFAULT_TYPE,
+) -> MutableMapping[str, object] | None:
+    """Return the application-wide ``bot_data`` mapping if available."""
+
+    bot_data = getattr(context, "bot_data", None)
+    if not isinstance(bot_data, MutableMapping):
+        application = getattr(context, "application", None)
+        bot_data = getattr(application, "bot_data", None) if application else None
+    if not isinstance(bot_data, MutableMapping):
+        return None
+    return bot_data
+
+
+def _get_bot_data_dict(
+    context: ContextTypes.DEFAULT_TYPE, key: str
+) -> MutableMapping | None:
+    """Return the dictionary stored under ``key`` in ``bot_data``."""
+
+    bot_data = _get_bot_data(context)
+    if bot_data is None:
+        return None
+
+    store = bot_data.get(key)
+    if not isinstance(store, MutableMapping):
+        store = {}
+        bot_data[key] = store
+    return store
+
+
+def _get_session_index(
+    context: ContextTypes.DEFAULT_TYPE,
+) -> tuple[MutableMapping[str, CoopSession], MutableMapping[int, str]] | None:
+    """Return the ``session_id -> session`` and ``user_id -> session_id`` indexes.
+
+    ``None`` means there is no ``bot_data`` and lookups have to scan chats.
+    """
+
+    by_id = _get_bot_data_dict(context, "coop_sessions")
+    by_user = _get_bot_data_dict(context, "coop_user_sessions")
+    if by_id is None or by_user is None:
+        return None
+    return by_id, by_user
+
+
+def _index_session(context: ContextTypes.DEFAULT_TYPE, session: CoopSession) -> None:
+    """Register ``session`` and its human players in the global indexes."""
+
+    index = _get_session_index(context)
+    if index is None:
+        return
+    by_id, by_user = index
+    by_id[session.session_id] = session
+    for pid in session.players:
+        if isinstance(pid, int) and pid != DUMMY_PLAYER_ID:
+            by_user[pid] = session.session_id
+
+
 def _find_session_global(
     context: ContextTypes.DEFAULT_TYPE, session_id: str
 ) -> CoopSession | None:
     """Find a cooperative session by identifier across chats."""
 
+    index = _get_session_index(context)
+    if index is not None:
+        return index[0].get(session_id)
+
     for sessions in _iter_session_maps(context):
         session = sessions.get(session_id)
         if session:
@@ -210,32 +374,27 @@ def _find_session_global(
 def _remove_session(
     context: ContextTypes.DEFAULT_TYPE, session: CoopSession
 ) -> None:
-    """Remove ``session`` from every chat's storage."""
+    """Remove ``session`` from the storage of the chats it was used in."""
 
-    for sessions in _iter_session_maps(context):
+    for sessions in _iter_player_session_maps(context, session):
         sessions.pop(session.session_id, None)
 
+    index = _get_session_index(context)
+    if index is None:
+        return
+    by_id, by_user = index
+    by_id.pop(session.session_id, None)
+    for pid in session.players:
+        if by_user.get(pid) == session.session_id:
+            del by_user[pid]
+
 
 def _get_rematch_store(
     context: ContextTypes.DEFAULT_TYPE,
 ) -> MutableMapping[str, dict] | None:
     """Return the dictionary used for storing rematch metadata."""
 
-    bot_data = getattr(context, "bot_data", None)
-    if not isinstance(bot_data, MutableMapping):
-        application = getattr(context, "application", None)
-        bot_data = getattr(application, "bot_data", None) if application else None
-    if not isinstance(bot_data, MutableMapping):
-        return None
-
-    store = bot_data.get("coop_rematch")
-    if store is None:
-        store = {}
-        bot_data["coop_rematch"] = store
-    if not isinstance(store, MutableMapping):
-        store = {}
-        bot_data["coop_rematch"] = store
-    return store
+    return _get_bot_data_dict(context, "coop_rematch")
 
 
 def _store_rematch_data(
@@ -278,6 +437,19 @@ def _find_user_session_global(
 ) -> tuple[str, CoopSession] | tuple[None, None]:
     """Locate a session that already involves ``user_id``."""
 
+    index = _get_session_index(context)
+    if index is not None:
+        by_id, by_user = index
+        sid = by_user.get(user_id)
+        session = by_id.get(sid) if sid is not None else None
+        if (
+            session is None
+            or getattr(session, "finished", False)
+            or user_id not in session.players
+        ):
+            return None, None
+        return sid, session
+
     for sessions in _iter_session_maps(context):
         sid, session = _find_user_session(sessions, user_id)
         if session:
@@ -285,76 +457,243 @@ def _find_user_session_global(
     return None, None
 
 
-async def _start_game(context: ContextTypes.DEFAULT_TYPE, session: CoopSession) -> None:
-    """Prepare the question queue and send an intro before the first question."""
+_NOT_SENT = object()
+# Pause before retrying a request that failed to reach Telegram.
+NETWORK_RETRY_DELAY = 0.5
+# Longest flood-control wait worth sitting out; answers hold the turn meanwhile.
+MAX_RETRY_AFTER = 5.0
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """Return the flood-control wait of ``error`` in seconds."""
+
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def _deliver(
+    chat_id: int, send: Callable[[], Awaitable[object]], warning: str
+) -> object:
+    """Await ``send()`` under the rate limiter, retrying once on transient errors.
 
-    countries = DATA.countries(session.continent_filter)
-    if session.continent_filter is None:
+    Returns the result of ``send()`` or ``_NOT_SENT`` after logging ``warning``.
+    Timeouts are not retried because the message may already have been sent,
+    and bad requests because they would fail again.
+    """
+
+    for attempt in range(2):
+        try:
+            async with limiter.acquire(chat_id):
+                return await send()
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            if attempt or delay > MAX_RETRY_AFTER:
+                logger.warning("%s: %s", warning, e)
+                return _NOT_SENT
+            # Flood control: wait as asked and try once more.
+            await asyncio.sleep(delay)
+        except (BadRequest, TimedOut) as e:
+            # BadRequest subclasses NetworkError but will fail again on retry.
+            logger.warning("%s: %s", warning, e)
+            return _NOT_SENT
+        except NetworkError as e:
+            if attempt:
+                logger.warning("%s: %s", warning, e)
+                return _NOT_SENT
+            await asyncio.sleep(NETWORK_RETRY_DELAY)
+        except (TelegramError, HTTPError) as e:
+            logger.warning("%s: %s", warning, e)
+            return _NOT_SENT
+    return _NOT_SENT
+
+
+async def _broadcast(
+    session: CoopSession,
+    send: Callable[[int, int], Awaitable[object]],
+    warning: str,
+    recipients: Iterable[int] | None = None,
+) -> list[tuple[int, int, object]]:
+    """Run ``send(pid, chat_id)`` for every recipient concurrently.
+
+    Returns ``(pid, chat_id, message)`` tuples for delivered messages in the
+    order of ``recipients`` (all players by default).
+    """
+
+    async def _send_one(pid: int) -> tuple[int, int, object] | None:
+        chat_id = session.player_chats.get(pid)
+        if not chat_id:
+            return None
+        message = await _deliver(chat_id, lambda: send(pid, chat_id), warning)
+        if message is _NOT_SENT:
+            return None
+        return pid, chat_id, message
+
+    if recipients is None:
+        recipients = session.players
+    results = await asyncio.gather(*(_send_one(pid) for pid in recipients))
+    return [result for result in results if result is not None]
+
+
+def _pop_next_pair(session: CoopSession) -> None:
+    """Drop the question at the front of the queue."""
+
+    pairs = session.remaining_pairs
+    if isinstance(pairs, deque):
+        pairs.popleft()
+    else:
+        # Sessions restored or built by hand may still carry a plain list.
+        del pairs[0]
+
+
+def _build_question_queue(continent_filter: str | None) -> deque[dict]:
+    """Return shuffled questions for a match on ``continent_filter``.
+
+    This takes well under a millisecond, so it runs on the event loop.
+    """
+
+    countries = DATA.countries(continent_filter)
+    if continent_filter is None:
         countries = random.sample(countries, k=min(30, len(countries)))
-    session.remaining_pairs = []
-    for country in countries:
-        mode = random.choice(["country_to_capital", "capital_to_country"])
-        item = (
-            country if mode == "country_to_capital" else DATA.capital_by_country[country]
+    capital_by_country = DATA.capital_by_country
+    modes = random.choices(QUESTION_MODES, k=len(countries))
+    pairs = [
+        make_card_question(
+            DATA,
+            country if mode == "country_to_capital" else capital_by_country[country],
+            mode,
+            continent_filter,
         )
-        q = make_card_question(DATA, item, mode, session.continent_filter)
-        session.remaining_pairs.append(q)
-    random.shuffle(session.remaining_pairs)
+        for country, mode in zip(countries, modes)
+    ]
+    random.shuffle(pairs)
+    return deque(pairs)
+
+
+async def _start_game(context: ContextTypes.DEFAULT_TYPE, session: CoopSession) -> None:
+    """Prepare the question queue and send an intro before the first question."""
+
+    session.remaining_pairs = _build_question_queue(session.continent_filter)
     session.current_pair = None
     session.turn_index = 0
     session.player_stats = {pid: 0 for pid in session.players}
+    session.players_total = 0
     session.bot_team_score = 0
     session.bot_team = []
     session.turn_order = []
+    session._turn_setup_done = False
     session.bot_turn_index = 0
     session.turns_since_scoreboard = 0
     _ensure_turn_setup(session)
     session.total_pairs = len(session.remaining_pairs)
     session.question_message_ids.clear()
     session.fact_message_ids.clear()
+    session._fact_keys_by_message_id.clear()
     session.fact_message_groups.clear()
     session.fact_subject = None
     session.fact_text = None
 
-    intro_text = (
-        "🌍 <b>Кооперативный матч начинается!</b>\n\n"
-        "Команда людей: вы и ваш напарник. Вместе вы бросаете вызов дуэту ботов!\n"
-        "🤖 <b>Команда соперников:</b> Бот Атлас и Бот Глобус — неутомимые проводники по миру столиц.\n\n"
-        f"📦 Всего вопросов: <b>{session.total_pairs}</b>.\n"
-        "🔁 Порядок ходов:\n"
-        "   1️⃣ Игрок 1\n"
-        "   2️⃣ Бот Атлас\n"
-        "   3️⃣ Игрок 2\n"
-        "   4️⃣ Бот Глобус\n\n"
-        "🎯 Чтобы победить, наберите больше очков, чем команда ботов. При равенстве объявляется ничья.\n"
-        "🚀 Готовы? Первый вопрос появится уже через пару секунд!"
-    )
-    for pid in session.players:
-        chat_id = session.player_chats.get(pid)
-        if not chat_id:
-            continue
-        try:
-            await context.bot.send_message(chat_id, intro_text, parse_mode="HTML")
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to send coop intro: %s", e)
-
+    intro_text = INTRO_TEMPLATE.format(total=session.total_pairs)
     logger.debug(
         "Delaying first cooperative question for session %s by %s seconds",
         session.session_id,
         FIRST_TURN_DELAY,
     )
-    await asyncio.sleep(FIRST_TURN_DELAY)
+    # Count the first-turn delay from the moment the intro starts going out.
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await _broadcast(
+        session,
+        lambda pid, chat_id: context.bot.send_message(
+            chat_id, intro_text, parse_mode="HTML"
+        ),
+        "Failed to send coop intro",
+    )
+    await _ask_after(
+        context, session, max(FIRST_TURN_DELAY - (loop.time() - started), 0)
+    )
+
+
+async def _ask_next_pair(context: ContextTypes.DEFAULT_TYPE, session: CoopSession) -> None:
+    """Ask the next question, or finish the match if none are left."""
+
+    if not session.remaining_pairs:
+        await _finish_game(context, session)
+        return
     await _ask_current_pair(context, session)
 
 
+async def _ask_next_pair_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback fired when a delayed coop question is due."""
+
+    session = _find_session_global(context, context.job.data["session_id"])
+    if not session or getattr(session, "finished", False):
+        return
+    await _ask_next_pair(context, session)
+
+
+async def _ask_after(
+    context: ContextTypes.DEFAULT_TYPE, session: CoopSession, delay: float
+) -> None:
+    """Ask the next question of ``session`` after ``delay`` seconds.
+
+    With a job queue the wait does not keep a task alive, and a cancelled
+    match is simply skipped when the job fires.
+    """
+
+    application = getattr(context, "application", None)
+    job_queue = getattr(application, "job_queue", None)
+    if job_queue is None:
+        await asyncio.sleep(delay)
+        await _ask_next_pair(context, session)
+        return
+    name = f"coop_turn_{session.session_id}"
+    for job in job_queue.get_jobs_by_name(name):
+        job.schedule_removal()
+    job_queue.run_once(
+        _ask_next_pair_job,
+        delay,
+        data={"session_id": session.session_id},
+        name=name,
+    )
+
+
+async def _run_detached(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, coro: Awaitable[None]
+) -> None:
+    """Run ``coro`` in the background so the handler can return at once.
+
+    Errors are reported by the application's error handlers.  Contexts without
+    an application task runner (e.g. in tests) await ``coro`` inline.
+    """
+
+    application = getattr(context, "application", None)
+    create_task = getattr(application, "create_task", None)
+    if create_task is None:
+        await coro
+        return
+    create_task(coro, update=update)
+
+
+async def _launch_game(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, session: CoopSession
+) -> None:
+    """Start ``session`` without holding up the current handler."""
+
+    await _run_detached(update, context, _start_game(context, session))
+
+
 def _is_flag_emoji(value: str) -> bool:
     """Return ``True`` if ``value`` looks like a regional flag emoji."""
 
     if len(value) != 2:
         return False
-    return all(0x1F1E6 <= ord(char) <= 0x1F1FF for char in value)
+    first, second = ord(value[0]), ord(value[1])
+    return 0x1F1E6 <= first <= 0x1F1FF and 0x1F1E6 <= second <= 0x1F1FF
 
 
+@lru_cache(maxsize=1024)
 def _split_flag_answer(option: str | None) -> tuple[str, str]:
     """Split ``option`` into (flag, text) components."""
 
@@ -426,20 +765,18 @@ async def _auto_answer_dummy(
 
     name = session.player_names.get(DUMMY_PLAYER_ID, "Бот-помощник")
     if should_answer_correct:
-        projected = sum(session.player_stats.values()) + session.bot_team_score + 1
+        projected = session.players_total + session.bot_team_score + 1
         await _broadcast_correct_answer(context, session, name, projected)
         await asyncio.sleep(CORRECT_ANSWER_DELAY)
     else:
         text = f"{name} отвечает неверно ({chosen_option})."
-
-        for pid in session.players:
-            chat_id = session.player_chats.get(pid)
-            if not chat_id:
-                continue
-            try:
-                await context.bot.send_message(chat_id, text, parse_mode="HTML")
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send dummy answer summary: %s", e)
+        await _broadcast(
+            session,
+            lambda pid, chat_id: context.bot.send_message(
+                chat_id, text, parse_mode="HTML"
+            ),
+            "Failed to send dummy answer summary",
+        )
 
     await _next_turn(context, session, should_answer_correct, participant=DUMMY_PLAYER_ID)
 
@@ -471,15 +808,13 @@ async def _handle_bot_turn(
             elif options:
                 bot_answer = options[0]
         text = _format_bot_wrong_answer(pair, bot_answer, bot_name)
-
-        for pid in session.players:
-            chat_id = session.player_chats.get(pid)
-            if not chat_id:
-                continue
-            try:
-                await context.bot.send_message(chat_id, text, parse_mode="HTML")
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to notify about bot move: %s", e)
+        await _broadcast(
+            session,
+            lambda pid, chat_id: context.bot.send_message(
+                chat_id, text, parse_mode="HTML"
+            ),
+            "Failed to notify about bot move",
+        )
 
     await _next_turn(context, session, bot_correct, participant=bot_id)
 
@@ -510,50 +845,61 @@ async def _ask_current_pair(context: ContextTypes.DEFAULT_TYPE, session: CoopSes
     session.question_message_ids.clear()
     recipients = [pid for pid in session.players if pid != DUMMY_PLAYER_ID]
 
-    for pid in recipients:
-        chat_id = session.player_chats.get(pid)
-        if not chat_id:
-            continue
-        reply_markup = None
-        if isinstance(current_participant, int) and pid == current_participant:
-            reply_markup = coop_answer_kb(
-                session.session_id, current_participant, session.current_pair["options"]
-            )
-        try:
-            msg = await context.bot.send_message(
-                chat_id,
-                question_text,
-                reply_markup=reply_markup,
-                parse_mode="HTML",
-            )
-            key = _participant_key(pid)
-            session.question_message_ids[key] = msg.message_id
-            if isinstance(pid, int):
-                session.question_message_ids[pid] = msg.message_id
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to send coop question: %s", e)
-
-    key = _participant_key(current_participant)
-    session.question_message_ids.setdefault(key, None)
-    if isinstance(current_participant, int):
-        session.question_message_ids.setdefault(current_participant, None)
+    answer_kb = None
+    if isinstance(current_participant, int) and current_participant in recipients:
+        answer_kb = coop_answer_kb(
+            session.session_id, current_participant, session.current_pair["options"]
+        )
 
-    if current_participant == DUMMY_PLAYER_ID:
-        await _auto_answer_dummy(context, session)
-        return
+    def _send_question(pid: int, chat_id: int) -> Awaitable[object]:
+        return context.bot.send_message(
+            chat_id,
+            question_text,
+            reply_markup=answer_kb if pid == current_participant else None,
+            parse_mode="HTML",
+        )
 
-    if _is_bot_participant(current_participant):
-        bot_name = _get_participant_display_name(session, current_participant)
+    broadcast = _broadcast(
+        session, _send_question, "Failed to send coop question", recipients
+    )
+    bot_turn = _is_bot_participant(current_participant)
+    if bot_turn:
         logger.debug(
             "Bot %s thinking for %s seconds before answering in session %s",
-            bot_name,
+            participant_name,
             BOT_THINKING_DELAY,
             session.session_id,
         )
-        await asyncio.sleep(BOT_THINKING_DELAY)
+        # The bot "thinks" while the question is still being delivered.
+        sent, _ = await asyncio.gather(broadcast, asyncio.sleep(BOT_THINKING_DELAY))
+    else:
+        sent = await broadcast
+    for pid, _chat_id, msg in sent:
+        session.question_message_ids[_participant_key(pid)] = msg.message_id
+    session.question_message_ids.setdefault(_participant_key(current_participant), None)
+
+    if current_participant == DUMMY_PLAYER_ID:
+        await _auto_answer_dummy(context, session)
+        return
+
+    if bot_turn:
         await _handle_bot_turn(context, session, current_participant)
 
 
+def _remember_flag_file_id(
+    flag_key: str, sent: list[tuple[int, int, object]]
+) -> str | None:
+    """Store the ``file_id`` Telegram assigned to an uploaded flag photo."""
+
+    for _pid, _chat_id, msg in sent:
+        photos = getattr(msg, "photo", None)
+        file_id = getattr(photos[-1], "file_id", None) if photos else None
+        if isinstance(file_id, str):
+            _FLAG_FILE_IDS[flag_key] = file_id
+            return file_id
+    return None
+
+
 async def _broadcast_correct_answer(
     context: ContextTypes.DEFAULT_TYPE,
     session: CoopSession,
@@ -571,17 +917,16 @@ async def _broadcast_correct_answer(
 
     fact = get_static_fact(country)
     header = f"✅ {name} отвечает верно."
-    body = (
-        f"{country}\nСтолица: {capital}\n\n{fact}\n\n"
-        "Нажми кнопку ниже, чтобы узнать еще один факт"
-    )
+    body = f"{country}\nСтолица: {capital}\n\n{fact}{_MORE_FACT_HINT}"
     caption_text = f"{header}\n\n{body}"
 
     flag_path = get_flag_image_path(country)
+    flag_key = str(flag_path) if flag_path else None
+    flag_file_id = _FLAG_FILE_IDS.get(flag_key) if flag_key else None
     flag_bytes: bytes | None = None
-    if flag_path:
+    if flag_path and flag_file_id is None:
         try:
-            flag_bytes = flag_path.read_bytes()
+            flag_bytes = await asyncio.to_thread(read_flag_image, str(flag_path))
         except OSError as exc:
             logger.warning("Failed to read flag image for %s: %s", country, exc)
             flag_bytes = None
@@ -589,7 +934,7 @@ async def _broadcast_correct_answer(
     session.fact_subject = country
     session.fact_text = fact
     kb = coop_fact_more_kb(session.session_id)
-    group_id = uuid.uuid4().hex
+    group_id = secrets.token_hex(16)
     group_entry = {
         "country": country,
         "fact": fact,
@@ -597,46 +942,55 @@ async def _broadcast_correct_answer(
         "resolved": False,
     }
 
-    for pid in session.players:
-        chat_id = session.player_chats.get(pid)
-        if not chat_id:
+    def _send_summary(pid: int, chat_id: int) -> Awaitable[object]:
+        if flag_file_id is not None:
+            return context.bot.send_photo(
+                chat_id, photo=flag_file_id, caption=caption_text, reply_markup=kb
+            )
+        if flag_bytes is not None and flag_path is not None:
+            # Each request consumes its own stream, so wrap the bytes per chat.
+            photo = BytesIO(flag_bytes)
+            photo.name = flag_path.name
+            return context.bot.send_photo(
+                chat_id, photo=photo, caption=caption_text, reply_markup=kb
+            )
+        return context.bot.send_message(
+            chat_id, caption_text, reply_markup=kb, parse_mode="HTML"
+        )
+
+    warning = "Failed to send correct answer summary"
+    recipients = list(session.players)
+    sent: list[tuple[int, int, object]] = []
+    if flag_key and flag_file_id is None and flag_bytes is not None and recipients:
+        # Upload the flag once and let the other players reuse Telegram's copy.
+        sent = await _broadcast(session, _send_summary, warning, recipients[:1])
+        flag_file_id = _remember_flag_file_id(flag_key, sent)
+        recipients = recipients[1:]
+    sent += await _broadcast(session, _send_summary, warning, recipients)
+    for _pid, chat_id, msg in sent:
+        if not msg:
             continue
-        try:
-            msg = None
-            if flag_bytes is not None and flag_path is not None:
-                photo = BytesIO(flag_bytes)
-                photo.name = flag_path.name
-                msg = await context.bot.send_photo(
-                    chat_id, photo=photo, caption=caption_text, reply_markup=kb
-                )
-            else:
-                msg = await context.bot.send_message(
-                    chat_id, caption_text, reply_markup=kb, parse_mode="HTML"
-                )
-            if msg:
-                base_text = (
-                    getattr(msg, "caption", None)
-                    or getattr(msg, "text", None)
-                    or caption_text
-                )
-                key = _make_fact_message_key(chat_id, getattr(msg, "message_id", None))
-                if key is None:
-                    logger.debug(
-                        "Skipping fact metadata registration without key for chat %s", chat_id
-                    )
-                    continue
-                session.fact_message_ids[key] = {
-                    "chat_id": key[0],
-                    "message_id": key[1],
-                    "country": country,
-                    "fact": fact,
-                    "base_text": base_text,
-                    "has_photo": bool(getattr(msg, "photo", None)),
-                    "group": group_id,
-                }
-                group_entry["message_ids"].append(key)
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to send correct answer summary: %s", e)
+        base_text = (
+            getattr(msg, "caption", None)
+            or getattr(msg, "text", None)
+            or caption_text
+        ).replace(_MORE_FACT_HINT, "")
+        key = _make_fact_message_key(chat_id, getattr(msg, "message_id", None))
+        if key is None:
+            logger.debug(
+                "Skipping fact metadata registration without key for chat %s", chat_id
+            )
+            continue
+        _register_fact_message(session, key, {
+            "chat_id": key[0],
+            "message_id": key[1],
+            "country": country,
+            "fact": fact,
+            "base_text": base_text,
+            "has_photo": bool(getattr(msg, "photo", None)),
+            "group": group_id,
+        })
+        group_entry["message_ids"].append(key)
 
     if group_entry["message_ids"]:
         session.fact_message_groups[group_id] = group_entry
@@ -728,23 +1082,54 @@ def _make_fact_message_key(
         return None
 
 
+def _register_fact_message(
+    session: CoopSession, key: tuple[int, int], metadata: dict
+) -> None:
+    """Track a fact message and index it by its message id."""
+
+    session.fact_message_ids[key] = metadata
+    session._fact_keys_by_message_id[key[1]] = key
+
+
+def _forget_fact_message(session: CoopSession, key: tuple[int, int]) -> None:
+    """Stop tracking the fact message stored under ``key``."""
+
+    session.fact_message_ids.pop(key, None)
+    if session._fact_keys_by_message_id.get(key[1]) == key:
+        del session._fact_keys_by_message_id[key[1]]
+
+
+def _find_fact_message_key(
+    session: CoopSession, message_id: int
+) -> tuple[int, int] | None:
+    """Return the tracked fact message key for ``message_id`` in any chat."""
+
+    key = session._fact_keys_by_message_id.get(message_id)
+    if key is not None and key in session.fact_message_ids:
+        return key
+    return None
+
+
 def _has_pending_fact_messages(session: CoopSession) -> bool:
     """Return ``True`` if there are queued fact messages for extra facts."""
 
     return any(bool(value) for value in session.fact_message_ids.values())
 
 
+# Russian plural forms of "вопрос" ("many", "one", "few") and the form used
+# for each last digit outside the 11-14 range.
+_QUESTION_FORMS = ("вопросов", "вопрос", "вопроса")
+_PLURAL_CLASS_BY_LAST_DIGIT = (0, 1, 2, 2, 2, 0, 0, 0, 0, 0)
+
+
+@lru_cache(maxsize=128)
 def _format_remaining_questions_line(count: int) -> str:
     """Return a formatted string describing how many questions remain."""
 
-    remainder_10 = count % 10
-    remainder_100 = count % 100
-    if remainder_10 == 1 and remainder_100 != 11:
-        word = "вопрос"
-    elif 2 <= remainder_10 <= 4 and remainder_100 not in (12, 13, 14):
-        word = "вопроса"
+    if 11 <= count % 100 <= 14:
+        word = _QUESTION_FORMS[0]
     else:
-        word = "вопросов"
+        word = _QUESTION_FORMS[_PLURAL_CLASS_BY_LAST_DIGIT[count % 10]]
     return f"❓ Осталось <b>{count}</b> {word}"
 
 
@@ -754,32 +1139,24 @@ async def _broadcast_score(
     """Send the current team vs bot score to all players."""
 
     _ensure_turn_setup(session)
-    team_label = _format_team_label(session)
-    team_label_html = escape(team_label)
-    players_total = sum(session.player_stats.values())
+    players_total = session.players_total
     answered_total = players_total + session.bot_team_score
     remaining = max(session.total_pairs - answered_total, 0)
     remaining_line = _format_remaining_questions_line(remaining)
     bot_label = _format_bot_team_score_label(session)
-    bot_label_html = escape(bot_label)
-
-    text_lines = [
-        "📊 <b>Текущий счёт</b>",
-        f"🤝 Команда {team_label_html} — <b>{players_total}</b>",
-        f"🤖 {bot_label_html} — <b>{session.bot_team_score}</b>",
-    ]
-    text_lines.append(remaining_line)
-
-    text = "\n".join(text_lines)
+    text = SCORE_TEMPLATE.format(
+        team=session._team_label_html,
+        team_score=players_total,
+        bots=escape(bot_label),
+        bot_score=session.bot_team_score,
+        remaining=remaining_line,
+    )
 
-    for pid in session.players:
-        chat_id = session.player_chats.get(pid)
-        if not chat_id:
-            continue
-        try:
-            await context.bot.send_message(chat_id, text, parse_mode="HTML")
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to broadcast coop score: %s", e)
+    await _broadcast(
+        session,
+        lambda pid, chat_id: context.bot.send_message(chat_id, text, parse_mode="HTML"),
+        "Failed to broadcast coop score",
+    )
 
 
 async def _next_turn(
@@ -804,34 +1181,27 @@ async def _next_turn(
     if correct:
         if isinstance(participant, int):
             session.player_stats[participant] = session.player_stats.get(participant, 0) + 1
+            session.players_total += 1
         else:
             session.bot_team_score += 1
             member = _get_bot_member(session, participant)
             if member:
                 member.score += 1
         if session.remaining_pairs:
-            session.remaining_pairs.pop(0)
+            _pop_next_pair(session)
         session.current_pair = None
     elif isinstance(participant, int):
         session.player_stats.setdefault(participant, session.player_stats.get(participant, 0))
 
-    if session.turn_order:
-        session.turn_index = (session.turn_index + 1) % len(session.turn_order)
-    else:
-        session.turn_index = 0
-
     order_length = len(session.turn_order)
-    if order_length:
-        session.turns_since_scoreboard += 1
-    else:
-        session.turns_since_scoreboard = 0
+    session.turn_index = (session.turn_index + 1) % order_length
+    session.turns_since_scoreboard += 1
 
     pairs_left = bool(session.remaining_pairs)
 
     should_finish = not pairs_left
     should_broadcast = (
         not should_finish
-        and order_length > 0
         and (
             session.turns_since_scoreboard >= order_length or session.turn_index == 0
         )
@@ -849,20 +1219,14 @@ async def _next_turn(
         )
         await _broadcast_score(context, session)
         session.turns_since_scoreboard = 0
-        await asyncio.sleep(POST_SCOREBOARD_DELAY)
+        await _ask_after(context, session, POST_SCOREBOARD_DELAY)
     else:
         logger.debug(
             "Delaying next cooperative turn for session %s by %s seconds",
             session.session_id,
             TURN_TRANSITION_DELAY,
         )
-        await asyncio.sleep(TURN_TRANSITION_DELAY)
-
-    if not session.remaining_pairs:
-        await _finish_game(context, session)
-        return
-
-    await _ask_current_pair(context, session)
+        await _ask_after(context, session, TURN_TRANSITION_DELAY)
 
 
 async def _finish_game(context: ContextTypes.DEFAULT_TYPE, session: CoopSession) -> None:
@@ -874,13 +1238,10 @@ async def _finish_game(context: ContextTypes.DEFAULT_TYPE, session: CoopSession)
     if not _has_pending_fact_messages(session):
         _remove_session(context, session)
     _ensure_turn_setup(session)
-    team_label = _format_team_label(session)
-    team_label_html = escape(team_label)
-    players_total = sum(session.player_stats.values())
-    team_line = f"🤝 Команда {team_label_html} — <b>{players_total}</b>"
+    team_label_html = session._team_label_html
+    players_total = session.players_total
     bot_label = _format_bot_team_score_label(session)
     bot_label_html = escape(bot_label)
-    bot_line = f"🤖 {bot_label_html} — <b>{session.bot_team_score}</b>"
     if players_total > session.bot_team_score:
         result_line = f"🎉 Команда {team_label_html} <b>побеждает!</b>"
     elif players_total < session.bot_team_score:
@@ -888,68 +1249,90 @@ async def _finish_game(context: ContextTypes.DEFAULT_TYPE, session: CoopSession)
     else:
         result_line = "🤝 <b>Ничья — отличная игра!</b>"
 
-    text = (
-        "🏁 <b>Игра завершена!</b>\n"
-        f"{team_line}\n"
-        f"{bot_line}\n\n"
-        f"{result_line}"
+    text = FINAL_TEMPLATE.format(
+        team=team_label_html,
+        team_score=players_total,
+        bots=bot_label_html,
+        bot_score=session.bot_team_score,
+        result=result_line,
     )
     keyboard = coop_finish_kb(session.session_id)
-    for pid in session.players:
-        chat_id = session.player_chats.get(pid)
-        if not chat_id:
-            continue
-        try:
-            await context.bot.send_message(
-                chat_id, text, parse_mode="HTML", reply_markup=keyboard
-            )
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to send coop final result: %s", e)
+    await _broadcast(
+        session,
+        lambda pid, chat_id: context.bot.send_message(
+            chat_id, text, parse_mode="HTML", reply_markup=keyboard
+        ),
+        "Failed to send coop final result",
+    )
 
 
 # ===== Command handlers =====
 
 
-async def cmd_coop_capitals(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Create a new cooperative match and request player's name."""
-
-    chat = update.effective_chat
-    user = update.effective_user
+async def _reply(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, **kwargs
+) -> None:
+    """Answer the command message, or write to the chat if there is none."""
 
-    if chat.type != "private":
-        try:
-            if update.message:
-                await update.message.reply_text(
-                    "Команду /coop_capitals можно использовать только в личке."
-                )
-            else:
-                await context.bot.send_message(
-                    chat.id, "Команду /coop_capitals можно использовать только в личке."
-                )
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to notify coop_capitals restriction: %s", e)
+    try:
+        if update.message:
+            await update.message.reply_text(text, **kwargs)
+        else:
+            await context.bot.send_message(update.effective_chat.id, text, **kwargs)
+    except (TelegramError, HTTPError) as e:
+        logger.warning("Failed to send coop command reply: %s", e)
+
+
+async def _get_bot_username(context: ContextTypes.DEFAULT_TYPE) -> str | None:
+    """Return the bot's username, calling ``getMe`` at most once per process."""
+
+    bot_username = getattr(context.bot, "username", None)
+    if bot_username:
+        return bot_username
+    bot_data = _get_bot_data(context)
+    if bot_data is not None:
+        bot_username = bot_data.get("_bot_username")
+        if bot_username:
+            return bot_username
+    get_me = getattr(context.bot, "get_me", None)
+    if not get_me:
+        return None
+    try:
+        me = await get_me()
+    except (TelegramError, HTTPError) as e:
+        logger.warning("Failed to fetch bot username for coop link: %s", e)
+        return None
+    bot_username = getattr(me, "username", None)
+    if bot_username and bot_data is not None:
+        bot_data["_bot_username"] = bot_username
+    return bot_username
+
+
+async def cmd_coop_capitals(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create a new cooperative match and request player's name."""
+
+    chat = update.effective_chat
+    user = update.effective_user
+
+    if chat.type != "private":
+        await _reply(
+            update, context, "Команду /coop_capitals можно использовать только в личке."
+        )
         return
 
     sessions = _get_sessions(context)
     _, existing = _find_user_session_global(context, user.id)
     if existing:
-        try:
-            if update.message:
-                await update.message.reply_text(
-                    "У вас уже есть активный матч. Используйте /coop_cancel для отмены."
-                )
-            else:
-                await context.bot.send_message(
-                    chat.id,
-                    "У вас уже есть активный матч. Используйте /coop_cancel для отмены.",
-                )
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to notify existing coop match: %s", e)
+        await _reply(
+            update,
+            context,
+            "У вас уже есть активный матч. Используйте /coop_cancel для отмены.",
+        )
         return
 
-    session_id = uuid.uuid4().hex[:8]
+    session_id = secrets.token_hex(4)
     session = CoopSession(session_id=session_id)
-    session.players.append(user.id)
+    _add_player(session, user.id)
     session.player_chats[user.id] = chat.id
     selected_continent = context.user_data.get("continent")
     if selected_continent:
@@ -958,51 +1341,46 @@ async def cmd_coop_capitals(update: Update, context: ContextTypes.DEFAULT_TYPE)
             None if selected_continent == "Весь мир" else selected_continent
         )
     sessions[session_id] = session
+    _index_session(context, session)
     context.user_data["coop_pending"] = {"session_id": session_id, "stage": "name"}
 
-    try:
-        if update.message:
-            await update.message.reply_text("Матч создан. Как вас зовут?")
-        else:
-            await context.bot.send_message(chat.id, "Матч создан. Как вас зовут?")
-    except (TelegramError, HTTPError) as e:
-        logger.warning("Failed to request player name: %s", e)
+    await _reply(update, context, "Матч создан. Как вас зовут?")
 
 
 async def cmd_coop_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Join an existing cooperative match by its session id."""
 
     if update.effective_chat.type != "private":
-        await update.message.reply_text(
-            "Команду /coop_join можно использовать только в личке."
-        )
+        await _reply(update, context, "Команду /coop_join можно использовать только в личке.")
         return
 
     if not context.args:
-        await update.message.reply_text("Использование: /coop_join <код>")
+        await _reply(update, context, "Использование: /coop_join <код>")
         return
 
     session_id = context.args[0]
     sessions = _get_sessions(context)
     session = _find_session_global(context, session_id)
     if not session:
-        await update.message.reply_text("Матч не найден")
+        await _reply(update, context, "Матч не найден")
         return
 
-    sessions[session_id] = session
     user_id = update.effective_user.id
     if user_id in session.players:
-        await update.message.reply_text("Вы уже участвуете в этом матче")
+        await _reply(update, context, "Вы уже участвуете в этом матче")
         return
     if len(session.players) >= 2:
-        await update.message.reply_text("В матче уже хватает игроков")
+        await _reply(update, context, "В матче уже хватает игроков")
         return
 
-    session.players.append(user_id)
+    _add_player(session, user_id)
+    _index_session(context, session)
     session.player_chats[user_id] = update.effective_chat.id
+    # Cache only once this chat is a player chat that _remove_session clears.
+    sessions[session_id] = session
     context.user_data["coop_pending"] = {"session_id": session_id, "stage": "name"}
 
-    await update.message.reply_text("Введите ваше имя")
+    await _reply(update, context, "Введите ваше имя")
 
 
 async def cmd_coop_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1011,23 +1389,20 @@ async def cmd_coop_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     _get_sessions(context)
     _, session = _find_user_session_global(context, update.effective_user.id)
     if not session:
-        await update.message.reply_text("Активных матчей не найдено")
+        await _reply(update, context, "Активных матчей не найдено")
         return
 
     _remove_session(context, session)
-    for pid in session.players:
-        chat_id = session.player_chats.get(pid)
-        if not chat_id:
-            continue
-        try:
-            if pid == update.effective_user.id:
-                await context.bot.send_message(chat_id, "Матч отменён")
-            else:
-                await context.bot.send_message(
-                    chat_id, "Соперник покинул матч. Игра отменена"
-                )
-        except (TelegramError, HTTPError) as e:
-            logger.warning("Failed to notify match cancel: %s", e)
+    user_id = update.effective_user.id
+
+    async def _send(pid: int, chat_id: int) -> object:
+        if pid == user_id:
+            return await context.bot.send_message(chat_id, "Матч отменён")
+        return await context.bot.send_message(
+            chat_id, "Соперник покинул матч. Игра отменена"
+        )
+
+    await _broadcast(session, _send, "Failed to notify match cancel")
 
 
 async def cmd_coop_test(
@@ -1045,7 +1420,7 @@ async def cmd_coop_test(
         return
 
     sessions = _get_sessions(context)
-    session_id = uuid.uuid4().hex[:8]
+    session_id = secrets.token_hex(4)
     session = CoopSession(session_id=session_id)
     human_id = user.id
     human_chat_id = chat.id if chat else None
@@ -1063,658 +1438,679 @@ async def cmd_coop_test(
             None if selected_continent == "Весь мир" else selected_continent
         )
     sessions[session_id] = session
+    _index_session(context, session)
 
-    await _start_game(context, session)
+    await _launch_game(update, context, session)
 
 
 # ===== Message & callback handlers =====
 
 
-async def msg_coop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle text messages for cooperative mode (name entry)."""
+def _get_field(obj: object, name: str) -> object:
+    """Read ``name`` from a Telegram object or its raw ``dict`` payload."""
 
-    pending = context.user_data.get("coop_pending")
-    if not pending:
+    if isinstance(obj, Mapping):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+async def _clear_markup(q: CallbackQuery) -> None:
+    """Remove the inline keyboard from the message behind ``q``."""
+
+    message = getattr(q, "message", None)
+    if message is not None and getattr(message, "reply_markup", True) is None:
+        return
+    edit = getattr(q, "edit_message_reply_markup", None)
+    if edit is None:
         return
+    try:
+        await edit(None)
+    except (TelegramError, HTTPError) as e:
+        logger.debug("Failed to clear coop keyboard: %s", e)
+
+
+def _resolve_session(
+    context: ContextTypes.DEFAULT_TYPE,
+    sessions: MutableMapping[str, CoopSession],
+    session_id: str,
+    user_id: int,
+) -> CoopSession | None:
+    """Return ``session_id`` from this chat or any other.
+
+    The session is cached in this chat only for its players, whose chats
+    ``_remove_session`` clears later.
+    """
 
-    session_id = pending.get("session_id")
-    stage = pending.get("stage")
-    sessions = _get_sessions(context)
     session = sessions.get(session_id)
-    if not session:
-        session = _find_session_global(context, session_id)
-        if not session:
-            context.user_data.pop("coop_pending", None)
-            return
+    if session:
+        return session
+    session = _find_session_global(context, session_id)
+    if session and user_id in session.players:
         sessions[session_id] = session
+    return session
 
-    user_id = update.effective_user.id
 
-    if stage == "name":
-        if not update.message or not update.message.text:
-            await update.message.reply_text("Пожалуйста, отправьте имя текстом")
-            return
-        session.player_names[user_id] = update.message.text.strip()
-        if len(session.players) == 1:
-            pending["stage"] = "invite"
+async def _msg_name(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CoopSession,
+    pending: dict,
+    user_id: int,
+) -> None:
+    """Store the player name and move on to the invite or continent step."""
+
+    session_id = session.session_id
+    if not update.message or not update.message.text:
+        await update.message.reply_text("Пожалуйста, отправьте имя текстом")
+        return
+    session.player_names[user_id] = update.message.text.strip()
+    if len(session.players) == 1:
+        pending["stage"] = "invite"
+        await update.message.reply_text(
+            "Имя сохранено. Пригласите второго игрока.",
+            reply_markup=coop_invite_kb(),
+        )
+    else:
+        context.user_data.pop("coop_pending", None)
+        if session.continent_label:
+            continent_name = session.continent_label
             await update.message.reply_text(
-                "Имя сохранено. Пригласите второго игрока.",
-                reply_markup=coop_invite_kb(),
+                (
+                    "Имя сохранено. Континент: "
+                    f"{continent_name}. Матч начнётся через несколько секунд!"
+                ),
+            )
+            notice = (
+                "Второй игрок присоединился. Континент: "
+                f"{continent_name}. Матч начнётся через несколько секунд!"
+            )
+            await _broadcast(
+                session,
+                lambda pid, chat_id: context.bot.send_message(chat_id, notice),
+                "Failed to send coop start notice",
+                [pid for pid in session.players if pid != user_id],
             )
+            if len(session.players) >= 2:
+                await _launch_game(update, context, session)
         else:
-            context.user_data.pop("coop_pending", None)
-            if session.continent_label:
-                continent_name = session.continent_label
-                await update.message.reply_text(
-                    (
-                        "Имя сохранено. Континент: "
-                        f"{continent_name}. Матч начнётся через несколько секунд!"
-                    ),
-                )
-                for pid in session.players:
-                    if pid == user_id:
-                        continue
-                    chat_id = session.player_chats.get(pid)
-                    if not chat_id:
-                        continue
-                    try:
-                        await context.bot.send_message(
-                            chat_id,
-                            (
-                                "Второй игрок присоединился. Континент: "
-                                f"{continent_name}. Матч начнётся через несколько секунд!"
-                            ),
-                        )
-                    except (TelegramError, HTTPError) as e:
-                        logger.warning(
-                            "Failed to send coop start notice: %s", e
-                        )
-                if len(session.players) >= 2:
-                    await _start_game(context, session)
-            else:
-                await update.message.reply_text(
+            continent_kb = coop_continent_kb(session_id)
+            await asyncio.gather(
+                update.message.reply_text(
                     "Имя сохранено. Выберите континент.",
-                    reply_markup=coop_continent_kb(session_id),
-                )
-                first_player = session.players[0]
-                first_chat = session.player_chats[first_player]
-                await context.bot.send_message(
-                    first_chat,
-                    "Второй игрок присоединился. Выберите континент.",
-                    reply_markup=coop_continent_kb(session_id),
-                )
-
-    elif stage == "invite":
-        message = update.message
-        if not message:
-            return
+                    reply_markup=continent_kb,
+                ),
+                _broadcast(
+                    session,
+                    lambda pid, chat_id: context.bot.send_message(
+                        chat_id,
+                        "Второй игрок присоединился. Выберите континент.",
+                        reply_markup=continent_kb,
+                    ),
+                    "Failed to send continent prompt to host",
+                    [session.players[0]],
+                ),
+            )
+
 
-        users_shared = getattr(message, "users_shared", None)
-        if users_shared is None:
-            api_kwargs = getattr(message, "api_kwargs", None)
-            if isinstance(api_kwargs, Mapping):
-                raw_users_shared = api_kwargs.get("users_shared")
-                if isinstance(raw_users_shared, Mapping):
-                    raw_users = raw_users_shared.get("users")
-                    if isinstance(raw_users, (list, tuple)):
-                        users = tuple(
-                            SimpleNamespace(**user)
-                            if isinstance(user, Mapping)
-                            else user
-                            for user in raw_users
-                        )
-                    else:
-                        users = ()
-                    users_shared = SimpleNamespace(
-                        request_id=raw_users_shared.get("request_id"),
-                        users=users,
-                        user_ids=raw_users_shared.get("user_ids"),
-                    )
-        users_shared_users = (
-            getattr(users_shared, "users", None)
-            if users_shared is not None
-            else None
+async def _msg_invite(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CoopSession,
+    pending: dict,
+    user_id: int,
+) -> None:
+    """Send an invite to a shared contact or reply with an invite link."""
+
+    session_id = session.session_id
+    message = update.message
+    if not message:
+        return
+
+    users_shared = getattr(message, "users_shared", None)
+    if users_shared is None:
+        # Older library versions leave the raw payload in ``api_kwargs``.
+        api_kwargs = getattr(message, "api_kwargs", None)
+        if isinstance(api_kwargs, Mapping):
+            raw_users_shared = api_kwargs.get("users_shared")
+            if isinstance(raw_users_shared, Mapping):
+                users_shared = raw_users_shared
+    users_shared_users = _get_field(users_shared, "users")
+    shared_users_from_users = None
+    if users_shared_users:
+        candidates = (
+            users_shared_users
+            if isinstance(users_shared_users, (list, tuple))
+            else (users_shared_users,)
         )
-        shared_users_from_users = None
-        if users_shared_users:
-            try:
-                iterator = iter(users_shared_users)
-            except TypeError:
-                iterator = iter([users_shared_users])
-            for shared_user in iterator:
-                candidate_id = getattr(shared_user, "user_id", None)
-                if candidate_id:
-                    shared_users_from_users = candidate_id
-                    break
-        users_shared_ids = (
-            getattr(users_shared, "user_ids", None)
-            if users_shared is not None
-            else None
+        shared_users_from_users = next(
+            (
+                uid
+                for uid in (_get_field(u, "user_id") for u in candidates)
+                if uid
+            ),
+            None,
         )
-        shared_users_user_id = None
-        if users_shared_ids:
-            try:
-                shared_users_user_id = next(
-                    (uid for uid in users_shared_ids if uid),
-                    None,
-                )
-            except TypeError:
-                if isinstance(users_shared_ids, int) and users_shared_ids:
-                    shared_users_user_id = users_shared_ids
-
-        user_shared = getattr(message, "user_shared", None)
-        if user_shared is None:
-            api_kwargs = getattr(message, "api_kwargs", None)
-            if isinstance(api_kwargs, Mapping):
-                raw_user_shared = api_kwargs.get("user_shared")
-                if isinstance(raw_user_shared, Mapping):
-                    user_shared = SimpleNamespace(**raw_user_shared)
-        shared_user_id = getattr(user_shared, "user_id", None) if user_shared else None
-        contact = getattr(message, "contact", None)
-        contact_user_id = getattr(contact, "user_id", None) if contact else None
-        target_user_id = (
-            shared_users_from_users
-            or shared_users_user_id
-            or shared_user_id
-            or contact_user_id
+    users_shared_ids = _get_field(users_shared, "user_ids")
+    shared_users_user_id = None
+    if isinstance(users_shared_ids, int):
+        shared_users_user_id = users_shared_ids or None
+    elif isinstance(users_shared_ids, (list, tuple)):
+        shared_users_user_id = next(
+            (uid for uid in users_shared_ids if uid), None
         )
 
-        if target_user_id:
-            inviter_name = session.player_names.get(user_id, "Ваш друг")
-            invite_text = (
-                f"{inviter_name} приглашает вас присоединиться к кооперативной игре "
-                "«Столицы мира». Нажмите кнопку, чтобы вступить."
-            )
-            try:
-                await context.bot.send_message(
-                    target_user_id,
-                    invite_text,
-                    reply_markup=coop_join_kb(session_id),
-                )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to deliver coop invite: %s", e)
-                await message.reply_text(
-                    "Не удалось отправить приглашение. Отправьте ссылку вручную.",
-                )
-            else:
-                await message.reply_text(
-                    "Приглашение отправлено. Как только второй игрок присоединится, продолжим настройку матча.",
-                )
-            return
+    user_shared = getattr(message, "user_shared", None)
+    if user_shared is None:
+        api_kwargs = getattr(message, "api_kwargs", None)
+        if isinstance(api_kwargs, Mapping):
+            raw_user_shared = api_kwargs.get("user_shared")
+            if isinstance(raw_user_shared, Mapping):
+                user_shared = SimpleNamespace(**raw_user_shared)
+    shared_user_id = getattr(user_shared, "user_id", None) if user_shared else None
+    contact = getattr(message, "contact", None)
+    contact_user_id = getattr(contact, "user_id", None) if contact else None
+    target_user_id = (
+        shared_users_from_users
+        or shared_users_user_id
+        or shared_user_id
+        or contact_user_id
+    )
 
-        if users_shared is not None and not (
-            shared_users_from_users or shared_users_user_id
-        ):
+    if target_user_id:
+        inviter_name = session.player_names.get(user_id, "Ваш друг")
+        invite_text = INVITE_TEMPLATE.format(name=inviter_name)
+        try:
+            await context.bot.send_message(
+                target_user_id,
+                invite_text,
+                reply_markup=coop_join_kb(session_id),
+            )
+        except (TelegramError, HTTPError) as e:
+            logger.warning("Failed to deliver coop invite: %s", e)
             await message.reply_text(
-                "У этого контакта нет Telegram-аккаунта. Передайте ссылку вручную.",
+                "Не удалось отправить приглашение. Отправьте ссылку вручную.",
             )
-            return
-
-        if (user_shared and not shared_user_id) or (contact and not contact_user_id):
+        else:
             await message.reply_text(
-                "У этого контакта нет Telegram-аккаунта. Передайте ссылку вручную.",
+                "Приглашение отправлено. Как только второй игрок присоединится, продолжим настройку матча.",
             )
-            return
+        return
+
+    if users_shared is not None and not (
+        shared_users_from_users or shared_users_user_id
+    ):
+        await message.reply_text(
+            "У этого контакта нет Telegram-аккаунта. Передайте ссылку вручную.",
+        )
+        return
+
+    if (user_shared and not shared_user_id) or (contact and not contact_user_id):
+        await message.reply_text(
+            "У этого контакта нет Telegram-аккаунта. Передайте ссылку вручную.",
+        )
+        return
 
-        text = (message.text or "").strip()
-        if text and text.casefold() == "создать ссылку".casefold():
-            bot_username = getattr(context.bot, "username", None)
-            if not bot_username:
-                get_me = getattr(context.bot, "get_me", None)
-                if get_me:
-                    try:
-                        me = await get_me()
-                        bot_username = getattr(me, "username", None)
-                    except (TelegramError, HTTPError) as e:
-                        logger.warning("Failed to fetch bot username for coop link: %s", e)
-            if not bot_username:
-                await message.reply_text(
-                    "Не удалось получить имя бота. Попробуйте позже.",
-                )
-                return
-            invite_link = f"https://t.me/{bot_username}?start=coop_{session_id}"
+    text = (message.text or "").strip()
+    if text and text.casefold() == _CREATE_LINK_CF:
+        bot_username = await _get_bot_username(context)
+        if not bot_username:
             await message.reply_text(
-                f"Поделитесь этой ссылкой с другом:\n{invite_link}"
+                "Не удалось получить имя бота. Попробуйте позже.",
             )
             return
+        invite_link = INVITE_LINK_TEMPLATE.format(
+            bot=bot_username, session_id=session_id
+        )
+        await message.reply_text(
+            f"Поделитесь этой ссылкой с другом:\n{invite_link}"
+        )
+        return
 
 
-async def cb_coop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle cooperative mode callback queries."""
+_MSG_STAGE_HANDLERS = {
+    "name": _msg_name,
+    "invite": _msg_invite,
+}
 
-    q = update.callback_query
-    parts = q.data.split(":")
+
+async def msg_coop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle text messages for cooperative mode (name entry and invites)."""
+
+    pending = context.user_data.get("coop_pending")
+    if not pending:
+        return
+
+    session_id = pending.get("session_id")
+    stage = pending.get("stage")
     sessions = _get_sessions(context)
+    session = _resolve_session(
+        context, sessions, session_id, update.effective_user.id
+    )
+    if not session:
+        context.user_data.pop("coop_pending", None)
+        return
 
-    def get_session(session_id: str) -> CoopSession | None:
-        session = sessions.get(session_id)
-        if session:
-            return session
-        session = _find_session_global(context, session_id)
-        if session:
-            sessions[session_id] = session
-        return session
+    handler = _MSG_STAGE_HANDLERS.get(stage)
+    if handler is None:
+        return
+    await handler(update, context, session, pending, update.effective_user.id)
 
-    if len(parts) >= 2 and parts[1] == "cont":
-        session_id = parts[2]
-        continent = parts[3]
-        session = get_session(session_id)
-        if not session:
-            await q.answer()
-            return
-        if update.effective_user.id not in session.players:
-            await q.answer("Не ваша кнопка", show_alert=True)
-            return
-        if session.continent_label is not None:
-            await q.answer("Континент уже выбран", show_alert=True)
-            try:
-                await q.edit_message_reply_markup(None)
-            except Exception:
-                pass
-            return
-        session.continent_filter = None if continent == "Весь мир" else continent
-        session.continent_label = continent
+
+async def _cb_continent(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    parts: list[str],
+    sessions: MutableMapping[str, CoopSession],
+) -> None:
+    """Store the continent chosen for a match and start it."""
+
+    q = update.callback_query
+    session_id = parts[2]
+    continent = parts[3]
+    session = _resolve_session(
+        context, sessions, session_id, update.effective_user.id
+    )
+    if not session:
         await q.answer()
-        try:
-            await q.edit_message_reply_markup(None)
-        except Exception:
-            pass
-        for pid in session.players:
-            chat_id = session.player_chats.get(pid)
-            if not chat_id:
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id,
-                    "Континент выбран. Матч начнётся через несколько секунд!",
-                    parse_mode="HTML",
-                )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send coop start notice: %s", e)
-        if len(session.players) >= 2:
-            await _start_game(context, session)
         return
+    if update.effective_user.id not in session.players:
+        await q.answer("Не ваша кнопка", show_alert=True)
+        return
+    if session.continent_label is not None:
+        await q.answer("Континент уже выбран", show_alert=True)
+        await _clear_markup(q)
+        return
+    session.continent_filter = None if continent == "Весь мир" else continent
+    session.continent_label = continent
+    await q.answer()
+    await _clear_markup(q)
+    await _broadcast(
+        session,
+        lambda pid, chat_id: context.bot.send_message(
+            chat_id,
+            "Континент выбран. Матч начнётся через несколько секунд!",
+            parse_mode="HTML",
+        ),
+        "Failed to send coop start notice",
+    )
+    if len(session.players) >= 2:
+        await _launch_game(update, context, session)
 
-    if len(parts) == 2:
-        # coop:<continent> (admin quick start)
-        continent = parts[1]
+
+async def _cb_rematch(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    parts: list[str],
+    sessions: MutableMapping[str, CoopSession],
+) -> None:
+    """Create a new match with the players of a finished one."""
+
+    q = update.callback_query
+    if len(parts) < 3:
         await q.answer()
-        context.user_data["continent"] = continent
-        continent_filter = None if continent == "Весь мир" else continent
-        if context.user_data.pop("coop_admin", False):
-            # For admin quick start run test command
-            await cmd_coop_test(
-                update,
-                context,
-                user=q.from_user,
-                chat=q.message.chat,
-            )
-        else:
-            await cmd_coop_capitals(update, context)
-            _, session = _find_user_session_global(context, update.effective_user.id)
-            if session:
-                session.continent_filter = continent_filter
-                session.continent_label = continent
+        return
+    previous_session_id = parts[2]
+    store = _get_rematch_store(context)
+    rematch_data = store.get(previous_session_id) if store else None
+    if not rematch_data:
+        await q.answer("Матч уже недоступен", show_alert=True)
+        await _clear_markup(q)
         return
 
-    action = parts[1]
+    user_id = update.effective_user.id
+    players = list(rematch_data.get("players", []))
+    human_players = [
+        pid for pid in players if isinstance(pid, int) and pid != DUMMY_PLAYER_ID
+    ]
+    if user_id not in human_players:
+        await q.answer("Матч уже недоступен", show_alert=True)
+        return
 
-    if action == "rematch":
-        if len(parts) < 3:
-            await q.answer()
-            return
-        previous_session_id = parts[2]
-        store = _get_rematch_store(context)
-        rematch_data = store.get(previous_session_id) if store else None
-        if not rematch_data:
-            await q.answer("Матч уже недоступен", show_alert=True)
-            try:
-                await q.edit_message_reply_markup(None)
-            except Exception:
-                pass
-            return
+    new_session_id = secrets.token_hex(4)
+    new_session = CoopSession(session_id=new_session_id)
+    new_session.players = players
+    new_session.player_names = dict(rematch_data.get("player_names", {}))
+    new_session.player_chats = dict(rematch_data.get("player_chats", {}))
+    new_session.mode = rematch_data.get("mode", "mixed") or "mixed"
 
-        user_id = update.effective_user.id
-        players = list(rematch_data.get("players", []))
-        human_players = [
-            pid for pid in players if isinstance(pid, int) and pid != DUMMY_PLAYER_ID
-        ]
-        if user_id not in human_players:
-            await q.answer("Матч уже недоступен", show_alert=True)
-            return
+    chat = getattr(update, "effective_chat", None)
+    if chat and isinstance(user_id, int):
+        new_session.player_chats[user_id] = chat.id
 
-        new_session_id = uuid.uuid4().hex[:8]
-        new_session = CoopSession(session_id=new_session_id)
-        new_session.players = players
-        new_session.player_names = dict(rematch_data.get("player_names", {}))
-        new_session.player_chats = dict(rematch_data.get("player_chats", {}))
-        new_session.mode = rematch_data.get("mode", "mixed") or "mixed"
+    stored_continent_filter = rematch_data.get("continent_filter")
+    stored_continent_label = rematch_data.get("continent_label")
+    is_admin_test = bool(rematch_data.get("admin_test"))
 
-        chat = getattr(update, "effective_chat", None)
-        if chat and isinstance(user_id, int):
-            new_session.player_chats[user_id] = chat.id
+    if is_admin_test:
+        new_session.continent_filter = stored_continent_filter
+        new_session.continent_label = stored_continent_label
+    else:
+        new_session.continent_filter = None
+        new_session.continent_label = None
 
-        stored_continent_filter = rematch_data.get("continent_filter")
-        stored_continent_label = rematch_data.get("continent_label")
-        is_admin_test = bool(rematch_data.get("admin_test"))
+    sessions[new_session_id] = new_session
+    _index_session(context, new_session)
+    if store is not None:
+        store.pop(previous_session_id, None)
 
-        if is_admin_test:
-            new_session.continent_filter = stored_continent_filter
-            new_session.continent_label = stored_continent_label
-        else:
-            new_session.continent_filter = None
-            new_session.continent_label = None
+    await q.answer("Запускаю рематч!")
+    await _clear_markup(q)
+
+    if is_admin_test:
+        await _launch_game(update, context, new_session)
+        return
 
-        sessions[new_session_id] = new_session
-        if store is not None:
-            store.pop(previous_session_id, None)
+    previous_continent = stored_continent_label
+    if previous_continent is None and stored_continent_filter is not None:
+        previous_continent = stored_continent_filter
+    if previous_continent is None and stored_continent_filter is None:
+        previous_continent = "Весь мир"
+
+    message_lines = ["🔁 Рематч готов!", "Выберите континент для новой игры."]
+    if previous_continent:
+        message_lines.append(f"Предыдущий выбор: {previous_continent}.")
+
+    text = "\n".join(message_lines)
+    markup = coop_continent_kb(new_session_id)
+
+    await _broadcast(
+        new_session,
+        lambda pid, chat_id: context.bot.send_message(
+            chat_id, text, reply_markup=markup, parse_mode="HTML"
+        ),
+        "Failed to send rematch continent prompt",
+        human_players,
+    )
 
-        await q.answer("Запускаю рематч!")
-        try:
-            await q.edit_message_reply_markup(None)
-        except Exception:
-            pass
 
-        if is_admin_test:
-            await _start_game(context, new_session)
-            return
+async def _cb_test(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    parts: list[str],
+    sessions: MutableMapping[str, CoopSession],
+) -> None:
+    """Start an admin test match."""
 
-        previous_continent = stored_continent_label
-        if previous_continent is None and stored_continent_filter is not None:
-            previous_continent = stored_continent_filter
-        if previous_continent is None and stored_continent_filter is None:
-            previous_continent = "Весь мир"
+    await update.callback_query.answer()
+    if update.effective_user.id == ADMIN_ID:
+        await cmd_coop_test(update, context)
 
-        message_lines = ["🔁 Рематч готов!", "Выберите континент для новой игры."]
-        if previous_continent:
-            message_lines.append(f"Предыдущий выбор: {previous_continent}.")
 
-        text = "\n".join(message_lines)
-        markup = coop_continent_kb(new_session_id)
+async def _safe_send(
+    context: ContextTypes.DEFAULT_TYPE, chat_id: int | None, text: str, warning: str
+) -> None:
+    """Send ``text`` to ``chat_id`` if known, logging ``warning`` on failure."""
 
-        for pid in human_players:
-            chat_id = new_session.player_chats.get(pid)
-            if not chat_id:
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id, text, reply_markup=markup, parse_mode="HTML"
-                )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send rematch continent prompt: %s", e)
+    if not chat_id:
         return
+    await _deliver(chat_id, lambda: context.bot.send_message(chat_id, text), warning)
 
-    if action == "test":
-        if update.effective_user.id == ADMIN_ID:
-            await q.answer()
-            await cmd_coop_test(update, context)
-        else:
-            await q.answer()
+
+async def _cb_join(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    parts: list[str],
+    sessions: MutableMapping[str, CoopSession],
+) -> None:
+    """Add the user to a match from an invitation button."""
+
+    q = update.callback_query
+    session_id = parts[2]
+    chat = getattr(update, "effective_chat", None) or getattr(q.message, "chat", None)
+    chat_id = getattr(chat, "id", None)
+
+    async def _reject(text: str, warning: str) -> None:
+        await q.answer()
+        await _clear_markup(q)
+        await _safe_send(context, chat_id, text, warning)
+
+    session = _resolve_session(
+        context, sessions, session_id, update.effective_user.id
+    )
+    if not session:
+        await _reject("Матч не найден", "Failed to notify missing coop session")
+        return
+    if getattr(chat, "type", None) != "private":
+        await _reject(
+            "Присоединиться к матчу можно только в личке.",
+            "Failed to notify coop join chat restriction",
+        )
         return
 
-    if action == "join":
-        if len(parts) < 3:
-            await q.answer()
-            return
-        session_id = parts[2]
-        session = get_session(session_id)
-        if not session:
-            await q.answer()
-            try:
-                await q.edit_message_reply_markup(None)
-            except Exception:
-                pass
-            chat = getattr(update, "effective_chat", None) or getattr(q.message, "chat", None)
-            if chat:
-                try:
-                    await context.bot.send_message(chat.id, "Матч не найден")
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to notify missing coop session: %s", e)
-            return
+    user_id = update.effective_user.id
+    if user_id in session.players:
+        await _reject(
+            "Вы уже участвуете в этом матче", "Failed to notify coop duplicate join"
+        )
+        return
+    if len(session.players) >= 2:
+        await _reject(
+            "В матче уже хватает игроков", "Failed to notify coop full session"
+        )
+        return
 
-        chat = getattr(update, "effective_chat", None) or getattr(q.message, "chat", None)
-        chat_type = getattr(chat, "type", None)
-        if chat_type != "private":
-            await q.answer()
-            try:
-                await q.edit_message_reply_markup(None)
-            except Exception:
-                pass
-            if chat:
-                try:
-                    await context.bot.send_message(
-                        chat.id,
-                        "Присоединиться к матчу можно только в личке.",
-                    )
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to notify coop join chat restriction: %s", e)
-            return
+    _add_player(session, user_id)
+    _index_session(context, session)
+    if chat_id:
+        session.player_chats[user_id] = chat_id
+    context.user_data["coop_pending"] = {"session_id": session_id, "stage": "name"}
 
-        user_id = update.effective_user.id
-        if user_id in session.players:
-            await q.answer()
-            try:
-                await q.edit_message_reply_markup(None)
-            except Exception:
-                pass
-            if chat:
-                try:
-                    await context.bot.send_message(
-                        chat.id, "Вы уже участвуете в этом матче"
-                    )
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to notify coop duplicate join: %s", e)
-            return
+    await q.answer()
+    await _clear_markup(q)
+    await _safe_send(
+        context, chat_id, "Введите ваше имя", "Failed to prompt coop player name"
+    )
 
-        if len(session.players) >= 2:
-            await q.answer()
-            try:
-                await q.edit_message_reply_markup(None)
-            except Exception:
-                pass
-            if chat:
-                try:
-                    await context.bot.send_message(
-                        chat.id, "В матче уже хватает игроков"
-                    )
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to notify coop full session: %s", e)
-            return
+    host_id = session.players[0] if session.players else None
+    if host_id and host_id != user_id and host_id != DUMMY_PLAYER_ID:
+        await _safe_send(
+            context,
+            session.player_chats.get(host_id),
+            "Второй игрок подключился. Продолжайте настройку матча.",
+            "Failed to notify coop host about join",
+        )
 
-        session.players.append(user_id)
-        if chat:
-            session.player_chats[user_id] = chat.id
-        context.user_data["coop_pending"] = {"session_id": session_id, "stage": "name"}
 
-        await q.answer()
-        try:
-            await q.edit_message_reply_markup(None)
-        except Exception:
-            pass
+async def _show_typing(context: ContextTypes.DEFAULT_TYPE, chat_id: int | None) -> None:
+    """Show a typing indicator while a slow reply is being prepared."""
 
-        if chat:
-            try:
-                await context.bot.send_message(chat.id, "Введите ваше имя")
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to prompt coop player name: %s", e)
+    send_chat_action = getattr(context.bot, "send_chat_action", None)
+    if chat_id is None or send_chat_action is None:
+        return
+    try:
+        await send_chat_action(chat_id, ChatAction.TYPING)
+    except (TelegramError, HTTPError) as e:
+        logger.debug("Failed to send typing action: %s", e)
 
-        host_id = session.players[0] if session.players else None
-        if (
-            host_id
-            and host_id != user_id
-            and host_id != DUMMY_PLAYER_ID
-        ):
-            host_chat_id = session.player_chats.get(host_id)
-            if host_chat_id:
+
+async def _append_extra_fact(
+    context: ContextTypes.DEFAULT_TYPE,
+    session: CoopSession,
+    message: object,
+    key: tuple[int, int],
+    metadata: Mapping[str, object],
+    group_id: str | None,
+    group: dict | None,
+) -> None:
+    """Generate an extra fact and add it to every copy of the fact message."""
+
+    country = str(metadata.get("country") or session.fact_subject or "")
+    original_fact = str(metadata.get("fact") or session.fact_text or "")
+    extra, _ = await asyncio.gather(
+        generate_llm_fact(country, original_fact),
+        _show_typing(context, key[0]),
+    )
+
+    target_entries: list[tuple[int, int]] = []
+    seen_entries: set[tuple[int, int]] = set()
+    if group and group.get("message_ids"):
+        for entry in group["message_ids"]:
+            entry_key: tuple[int, int] | None = None
+            if isinstance(entry, tuple) and len(entry) == 2:
+                entry_key = _make_fact_message_key(entry[0], entry[1])
+            elif isinstance(entry, list) and len(entry) == 2:
+                entry_key = _make_fact_message_key(entry[0], entry[1])
+            else:
+                candidate_id: int | None = None
                 try:
-                    await context.bot.send_message(
-                        host_chat_id,
-                        "Второй игрок подключился. Продолжайте настройку матча.",
-                    )
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to notify coop host about join: %s", e)
-        return
+                    candidate_id = int(entry)
+                except (TypeError, ValueError):
+                    candidate_id = None
+                if candidate_id is not None:
+                    entry_key = _find_fact_message_key(session, candidate_id)
+            if entry_key and entry_key not in seen_entries:
+                seen_entries.add(entry_key)
+                target_entries.append(entry_key)
+
+    if key not in seen_entries:
+        seen_entries.add(key)
+        target_entries.append(key)
+
+    for entry_chat_id, entry_message_id in target_entries:
+        meta = session.fact_message_ids.get((entry_chat_id, entry_message_id))
+        if not meta:
+            continue
+        # ``base_text`` is stored without the hint when the message is sent.
+        base = str(meta.get("base_text") or "")
+        if not base:
+            base = (
+                getattr(message, "caption", None) or getattr(message, "text", None) or ""
+            ).replace(_MORE_FACT_HINT, "")
+        chat_id = meta.get("chat_id") or entry_chat_id
+        if meta.get("has_photo"):
+            editor, field_name = context.bot.edit_message_caption, "caption"
+        else:
+            editor, field_name = context.bot.edit_message_text, "text"
+        try:
+            await editor(
+                chat_id=chat_id,
+                message_id=entry_message_id,
+                reply_markup=None,
+                **{field_name: f"{base}\n\nЕще один факт: {extra}"},
+            )
+        except (TelegramError, HTTPError) as e:
+            logger.warning("Failed to send extra fact: %s", e)
+        finally:
+            _forget_fact_message(session, (entry_chat_id, entry_message_id))
 
-    if action == "more_fact":
-        session_id = parts[2]
-        session = get_session(session_id)
-        if not session:
-            try:
-                await q.answer()
-            except BadRequest as err:
-                logger.debug("Skipping stale callback answer for extra fact: %s", err)
-            return
-        pid = update.effective_user.id
-        if pid not in session.players:
-            try:
-                await q.answer("Не ваша кнопка", show_alert=True)
-            except BadRequest as err:
-                logger.debug(
-                    "Skipping stale callback alert for foreign player extra fact: %s", err
-                )
-            return
-        message = q.message
-        if not message:
-            try:
-                await q.answer()
-            except BadRequest as err:
-                logger.debug("Skipping stale callback answer without message: %s", err)
-            return
-        message_id = getattr(message, "message_id", None)
-        chat = getattr(message, "chat", None)
-        chat_id = getattr(chat, "id", None)
-        key = _make_fact_message_key(chat_id, message_id)
-        metadata = session.fact_message_ids.get(key) if key else None
-        normalized_message_id: int | None = None
-        if message_id is not None:
-            try:
-                normalized_message_id = int(message_id)
-            except (TypeError, ValueError):
-                normalized_message_id = None
-        if not metadata and normalized_message_id is not None:
-            for candidate_key, meta in session.fact_message_ids.items():
-                if (
-                    isinstance(candidate_key, tuple)
-                    and len(candidate_key) == 2
-                    and candidate_key[1] == normalized_message_id
-                ):
-                    metadata = meta
-                    key = candidate_key
-                    break
-                if meta.get("message_id") == normalized_message_id:
-                    metadata = meta
-                    fallback_key = _make_fact_message_key(
-                        meta.get("chat_id"), normalized_message_id
-                    )
-                    if fallback_key:
-                        key = fallback_key
-                    break
-        if not metadata or not key:
-            try:
-                await q.answer()
-            except BadRequest as err:
-                logger.debug("Skipping stale callback answer without metadata: %s", err)
-            return
+    if group_id:
+        session.fact_message_groups.pop(group_id, None)
+    if not _has_pending_fact_messages(session) and getattr(session, "finished", False):
+        _remove_session(context, session)
 
-        group_id = metadata.get("group")
-        group = session.fact_message_groups.get(group_id) if group_id else None
-        if group and group.get("resolved"):
-            try:
-                await q.answer()
-            except BadRequest as err:
-                logger.debug("Skipping stale callback answer for resolved group: %s", err)
-            return
-        if group:
-            group["resolved"] = True
 
+async def _cb_more_fact(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    parts: list[str],
+    sessions: MutableMapping[str, CoopSession],
+) -> None:
+    """Append an LLM-generated fact to every copy of a fact message."""
+
+    q = update.callback_query
+    session_id = parts[2]
+    session = _resolve_session(
+        context, sessions, session_id, update.effective_user.id
+    )
+    if not session:
         try:
             await q.answer()
         except BadRequest as err:
-            logger.debug("Skipping stale callback answer before generating extra fact: %s", err)
-        country = str(metadata.get("country") or session.fact_subject or "")
-        original_fact = str(metadata.get("fact") or session.fact_text or "")
-        extra = await generate_llm_fact(country, original_fact)
-
-        target_entries: list[tuple[int, int]] = []
-        seen_entries: set[tuple[int, int]] = set()
-        if group and group.get("message_ids"):
-            for entry in group["message_ids"]:
-                entry_key: tuple[int, int] | None = None
-                if isinstance(entry, tuple) and len(entry) == 2:
-                    entry_key = _make_fact_message_key(entry[0], entry[1])
-                elif isinstance(entry, list) and len(entry) == 2:
-                    entry_key = _make_fact_message_key(entry[0], entry[1])
-                else:
-                    candidate_id: int | None = None
-                    try:
-                        candidate_id = int(entry)
-                    except (TypeError, ValueError):
-                        candidate_id = None
-                    if candidate_id is not None:
-                        for candidate_key in session.fact_message_ids.keys():
-                            if (
-                                isinstance(candidate_key, tuple)
-                                and len(candidate_key) == 2
-                                and candidate_key[1] == candidate_id
-                            ):
-                                entry_key = candidate_key
-                                break
-                if entry_key and entry_key not in seen_entries:
-                    seen_entries.add(entry_key)
-                    target_entries.append(entry_key)
-
-        if key not in seen_entries:
-            seen_entries.add(key)
-            target_entries.append(key)
-
-        for entry_chat_id, entry_message_id in target_entries:
-            meta = session.fact_message_ids.get((entry_chat_id, entry_message_id))
-            if not meta:
-                continue
-            base_text = str(meta.get("base_text") or "")
-            if not base_text:
-                base_text = getattr(message, "caption", None) or getattr(message, "text", None) or ""
-            base = base_text.replace(
-                "\n\nНажми кнопку ниже, чтобы узнать еще один факт",
-                "",
+            logger.debug("Skipping stale callback answer for extra fact: %s", err)
+        return
+    pid = update.effective_user.id
+    if pid not in session.players:
+        try:
+            await q.answer("Не ваша кнопка", show_alert=True)
+        except BadRequest as err:
+            logger.debug(
+                "Skipping stale callback alert for foreign player extra fact: %s", err
             )
-            chat_id = meta.get("chat_id") or entry_chat_id
-            has_photo = bool(meta.get("has_photo"))
-            try:
-                if has_photo:
-                    await context.bot.edit_message_caption(
-                        chat_id=chat_id,
-                        message_id=entry_message_id,
-                        caption=f"{base}\n\nЕще один факт: {extra}",
-                        reply_markup=None,
-                    )
-                else:
-                    await context.bot.edit_message_text(
-                        text=f"{base}\n\nЕще один факт: {extra}",
-                        chat_id=chat_id,
-                        message_id=entry_message_id,
-                        reply_markup=None,
-                    )
-            except (TelegramError, HTTPError) as e:
-                logger.warning("Failed to send extra fact: %s", e)
-            finally:
-                session.fact_message_ids.pop((entry_chat_id, entry_message_id), None)
-
-        if group_id:
-            session.fact_message_groups.pop(group_id, None)
-        if not _has_pending_fact_messages(session) and getattr(session, "finished", False):
-            _remove_session(context, session)
+        return
+    message = q.message
+    if not message:
+        try:
+            await q.answer()
+        except BadRequest as err:
+            logger.debug("Skipping stale callback answer without message: %s", err)
+        return
+    message_id = getattr(message, "message_id", None)
+    chat = getattr(message, "chat", None)
+    chat_id = getattr(chat, "id", None)
+    key = _make_fact_message_key(chat_id, message_id)
+    metadata = session.fact_message_ids.get(key) if key else None
+    normalized_message_id: int | None = None
+    if message_id is not None:
+        try:
+            normalized_message_id = int(message_id)
+        except (TypeError, ValueError):
+            normalized_message_id = None
+    if not metadata and normalized_message_id is not None:
+        fallback_key = _find_fact_message_key(session, normalized_message_id)
+        if fallback_key is not None:
+            key = fallback_key
+            metadata = session.fact_message_ids[key]
+    if not metadata or not key:
+        try:
+            await q.answer()
+        except BadRequest as err:
+            logger.debug("Skipping stale callback answer without metadata: %s", err)
         return
 
-    if action != "ans":
-        await q.answer()
+    group_id = metadata.get("group")
+    group = session.fact_message_groups.get(group_id) if group_id else None
+    if group and group.get("resolved"):
+        try:
+            await q.answer()
+        except BadRequest as err:
+            logger.debug("Skipping stale callback answer for resolved group: %s", err)
         return
+    if group:
+        group["resolved"] = True
+
+    try:
+        await q.answer()
+    except BadRequest as err:
+        logger.debug("Skipping stale callback answer before generating extra fact: %s", err)
+    await _run_detached(
+        update,
+        context,
+        _append_extra_fact(context, session, message, key, metadata, group_id, group),
+    )
+
+
+async def _advance_turn(
+    context: ContextTypes.DEFAULT_TYPE, session: CoopSession, correct: bool
+) -> None:
+    """Move to the next turn, leaving time to read a correct answer's fact.
+
+    Releases the turn lock taken by ``_cb_answer``.
+    """
+
+    try:
+        if correct:
+            await asyncio.sleep(CORRECT_ANSWER_DELAY)
+        await _next_turn(context, session, correct)
+    finally:
+        if session._turn_lock.locked():
+            session._turn_lock.release()
+
+
+async def _cb_answer(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    parts: list[str],
+    sessions: MutableMapping[str, CoopSession],
+) -> None:
+    """Check an answer button press (``coop:ans:<sid>:<pid>:<idx>``)."""
 
-    # coop:ans:<sid>:<pid>:<idx>
+    q = update.callback_query
     session_id = parts[2]
     player_id = int(parts[3])
     idx = int(parts[4])
-    session = get_session(session_id)
+    session = _resolve_session(
+        context, sessions, session_id, update.effective_user.id
+    )
     if not session or not session.current_pair:
         await q.answer()
         return
@@ -1729,31 +2125,88 @@ async def cb_coop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if current_participant != player_id:
         await q.answer("Сейчас не ваш ход", show_alert=True)
         return
+    # A repeated tap on the same keyboard must not advance the turn twice.
+    if session._turn_lock.locked():
+        await q.answer()
+        return
+    await session._turn_lock.acquire()
 
-    option = session.current_pair["options"][idx]
-    correct = option == session.current_pair["correct"]
-    await q.answer()
     try:
-        await q.edit_message_reply_markup(None)
-    except Exception:
-        pass
+        pair = session.current_pair
+        option = pair["options"][idx]
+        correct = option == pair["correct"]
+        await q.answer()
+        await _clear_markup(q)
 
-    name = session.player_names.get(player_id, str(player_id))
-    if correct:
-        projected = sum(session.player_stats.values()) + session.bot_team_score + 1
-        await _broadcast_correct_answer(context, session, name, projected)
-        await asyncio.sleep(CORRECT_ANSWER_DELAY)
-    else:
-        text = f"{name} отвечает неверно ({option})."
-        for pid in session.players:
-            chat_id = session.player_chats.get(pid)
-            if chat_id:
-                try:
-                    await context.bot.send_message(chat_id, text, parse_mode="HTML")
-                except (TelegramError, HTTPError) as e:
-                    logger.warning("Failed to send answer summary: %s", e)
+        name = session.player_names.get(player_id, str(player_id))
+        if correct:
+            projected = session.players_total + session.bot_team_score + 1
+            await _broadcast_correct_answer(context, session, name, projected)
+        else:
+            text = f"{name} отвечает неверно ({option})."
+            await _broadcast(
+                session,
+                lambda pid, chat_id: context.bot.send_message(
+                    chat_id, text, parse_mode="HTML"
+                ),
+                "Failed to send answer summary",
+            )
+    except BaseException:
+        session._turn_lock.release()
+        raise
+
+    await _run_detached(update, context, _advance_turn(context, session, correct))
+
+
+# Callback handlers keyed by the action part of ``coop:<action>:...``.
+# action -> (handler, number of ``:``-separated fields it expects)
+_CB_HANDLERS = {
+    "cont": (_cb_continent, 4),
+    "rematch": (_cb_rematch, 3),
+    "test": (_cb_test, 2),
+    "join": (_cb_join, 3),
+    "more_fact": (_cb_more_fact, 3),
+    "ans": (_cb_answer, 5),
+}
+
+
+async def cb_coop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle cooperative mode callback queries."""
+
+    q = update.callback_query
+    parts = q.data.split(":", 4)
+    if len(parts) < 2:
+        await q.answer()
+        return
+    sessions = _get_sessions(context)
 
-    await _next_turn(context, session, correct)
+    if len(parts) == 2 and parts[1] != "cont":
+        # coop:<continent> (admin quick start)
+        continent = parts[1]
+        await q.answer()
+        context.user_data["continent"] = continent
+        continent_filter = None if continent == "Весь мир" else continent
+        if context.user_data.pop("coop_admin", False):
+            # For admin quick start run test command
+            await cmd_coop_test(
+                update,
+                context,
+                user=q.from_user,
+                chat=q.message.chat,
+            )
+        else:
+            await cmd_coop_capitals(update, context)
+            _, session = _find_user_session_global(context, update.effective_user.id)
+            if session:
+                session.continent_filter = continent_filter
+                session.continent_label = continent
+        return
+
+    handler, fields = _CB_HANDLERS.get(parts[1], (None, 0))
+    if handler is None or len(parts) < fields:
+        await q.answer()
+        return
+    await handler(update, context, parts, sessions)
 
 
 # Module exports
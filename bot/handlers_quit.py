@@ -1,5 +1,6 @@
 """Handlers to terminate any active sessions."""
 
+import asyncio
 from collections.abc import MutableMapping
 
 from telegram import Update
@@ -12,6 +13,7 @@ from .handlers_coop import (
     _find_user_session_global,
     _remove_session,
 )
+from .ratelimit import limiter
 
 
 SESSION_ENDED = "Сессия завершена. Нажмите /start, чтобы начать заново."
@@ -56,11 +58,17 @@ async def cmd_quit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         app_user_data = getattr(application, "user_data", {}) if application else {}
         for pid in session.players:
             _clear_user_state(app_user_data.get(pid))
-            chat_id = session.player_chats.get(pid, pid)
+
+        async def _notify(chat_id: int) -> None:
             try:
-                await context.bot.send_message(chat_id, SESSION_ENDED)
+                async with limiter.acquire(chat_id):
+                    await context.bot.send_message(chat_id, SESSION_ENDED)
             except (TelegramError, HTTPError):
                 pass
+
+        await asyncio.gather(
+            *(_notify(session.player_chats.get(pid, pid)) for pid in session.players)
+        )
         return
 
     chat_id = update.effective_chat.id
@@ -71,7 +71,8 @@ async def _next_question(
         await _finish_session(update, context)
         return
 
-    country = session.queue.pop(0)
+    # The queue is shuffled, so taking from the end avoids shifting the list.
+    country = session.queue.pop()
     direction = random.choice(["country_to_capital", "capital_to_country"])
     item = country if direction == "country_to_capital" else DATA.capital_by_country[country]
     question = make_card_question(DATA, item, direction)
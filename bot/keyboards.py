@@ -1,5 +1,7 @@
 """Inline keyboards used across the bot menus."""
 
+from collections.abc import Sequence
+from functools import lru_cache
 from inspect import signature
 from textwrap import shorten
 from unicodedata import east_asian_width
@@ -160,14 +162,20 @@ def sprint_start_kb(continent: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
-def cards_kb(options: list[str], prefix: str = "cards") -> InlineKeyboardMarkup:
+def cards_kb(options: Sequence[str], prefix: str = "cards") -> InlineKeyboardMarkup:
     """Keyboard for flash-card questions with answer options.
 
     ``prefix`` determines the callback namespace.  By default the regular
     ``cards`` prefix is used, but alternative prefixes (e.g. ``test``) can be
-    supplied for other handlers.
+    supplied for other handlers.  Markups are cached per option tuple since
+    ``InlineKeyboardMarkup`` objects are immutable.
     """
 
+    return _cards_kb(tuple(options), prefix)
+
+
+@lru_cache(maxsize=1024)
+def _cards_kb(options: tuple[str, ...], prefix: str) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
     buffer: list[InlineKeyboardButton] = []
     for i, opt in enumerate(options):
@@ -399,6 +407,7 @@ def coop_admin_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=1)
 def coop_invite_kb() -> ReplyKeyboardMarkup:
     """Keyboard for inviting the second player."""
 
@@ -443,6 +452,7 @@ def coop_rounds_kb(session_id: str, player_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=256)
 def coop_continent_kb(session_id: str) -> InlineKeyboardMarkup:
     """Keyboard to select continent for cooperative mode."""
 
@@ -478,6 +488,7 @@ def coop_answer_kb(session_id: str, player_id: int, options: list[str]) -> Inlin
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=256)
 def coop_fact_more_kb(session_id: str) -> InlineKeyboardMarkup:
     """Keyboard with a button to request another fact."""
 
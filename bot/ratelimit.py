@@ -0,0 +1,105 @@
+"""Token-bucket throttling for outgoing Telegram requests."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+
+# Telegram allows about 30 messages per second overall and roughly one
+# message per second in a single chat (short bursts are tolerated).
+GLOBAL_RPS = 28.0
+PER_CHAT_RPS = 1.0
+PER_CHAT_BURST = 3
+# Idle per-chat buckets are dropped once this many chats are tracked.
+MAX_TRACKED_CHATS = 4096
+
+
+class _Bucket:
+    """Token bucket whose refill is computed lazily on every reservation."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token and return how long the caller has to wait for it."""
+
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """Throttle requests to ``global_rps`` overall and ``per_chat_rps`` per chat.
+
+    Tokens are reserved synchronously, so concurrent callers on the same event
+    loop queue up in arrival order without any locking.  The limiter is not
+    bound to an event loop and can be shared at module level.
+    """
+
+    def __init__(
+        self,
+        global_rps: float = GLOBAL_RPS,
+        per_chat_rps: float = PER_CHAT_RPS,
+        per_chat_burst: int = PER_CHAT_BURST,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._clock = clock
+        self._per_chat_rps = per_chat_rps
+        self._per_chat_burst = per_chat_burst
+        self._global = _Bucket(global_rps, global_rps, clock())
+        self._chats: dict[int, _Bucket] = {}
+
+    def reserve(self, chat_id: int | None = None) -> float:
+        """Reserve a slot for ``chat_id`` and return the required delay."""
+
+        now = self._clock()
+        delay = self._global.reserve(now)
+        if chat_id is None:
+            return delay
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_TRACKED_CHATS:
+                self._prune(now)
+            bucket = _Bucket(self._per_chat_rps, self._per_chat_burst, now)
+            self._chats[chat_id] = bucket
+        return max(delay, bucket.reserve(now))
+
+    def reset(self) -> None:
+        """Forget all reservations, e.g. between tests."""
+
+        self._global = _Bucket(self._global.rate, self._global.capacity, self._clock())
+        self._chats.clear()
+
+    def _prune(self, now: float) -> None:
+        for key in [k for k, b in self._chats.items() if b.is_idle(now)]:
+            del self._chats[key]
+
+    @asynccontextmanager
+    async def acquire(self, chat_id: int | None = None) -> AsyncIterator[None]:
+        """Wait until a request to ``chat_id`` may be sent."""
+
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield
+
+
+limiter = RateLimiter()
+
+
+__all__ = ["RateLimiter", "limiter"]
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import asyncio
+from collections import deque
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Set
+from typing import Any, Deque, Dict, Iterable, List, Set
 
 import orjson
 from telegram.ext import Job
@@ -17,6 +19,10 @@ class DataSource:
     country_by_capital: Dict[str, str]
     country_to_continent: Dict[str, str]
     aliases: Dict[str, str]
+    # Sorted country/capital pools keyed by (kind, continent); data is static.
+    _pools: Dict[tuple[str, str | None], tuple[str, ...]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
 
     @classmethod
     def load(cls, path: str | Path) -> "DataSource":
@@ -55,21 +61,35 @@ class DataSource:
         return self.aliases.get(name.casefold(), name)
 
     def countries(self, continent: str | None = None) -> List[str]:
-        if continent and continent in self.countries_by_continent:
-            pool: Iterable[str] = self.countries_by_continent[continent]
-        else:
-            pool = {
-                country for countries in self.countries_by_continent.values() for country in countries
-            }
-        return sorted(pool)
+        return list(self._sorted_pool("countries", continent))
 
     def capitals(self, continent: str | None = None) -> List[str]:
-        if continent and continent in self.countries_by_continent:
-            countries = self.countries_by_continent[continent]
-            pool = [self.capital_by_country[c] for c in countries]
+        return list(self._sorted_pool("capitals", continent))
+
+    def _sorted_pool(self, kind: str, continent: str | None) -> tuple[str, ...]:
+        """Return the sorted countries or capitals of ``continent``, cached."""
+        if not (continent and continent in self.countries_by_continent):
+            continent = None
+        key = (kind, continent)
+        cached = self._pools.get(key)
+        if cached is not None:
+            return cached
+
+        if continent is not None:
+            countries: Iterable[str] = self.countries_by_continent[continent]
+        else:
+            countries = {
+                country for members in self.countries_by_continent.values() for country in members
+            }
+        if kind == "capitals":
+            if continent is not None:
+                pool: Iterable[str] = [self.capital_by_country[c] for c in countries]
+            else:
+                pool = self.capital_by_country.values()
         else:
-            pool = self.capital_by_country.values()
-        return sorted(pool)
+            pool = countries
+        cached = self._pools[key] = tuple(sorted(pool))
+        return cached
 
     def continent_of_country(self, country: str) -> str | None:
         return self.country_to_continent.get(country)
@@ -145,11 +165,13 @@ class CoopSession:
     continent_filter: str | None = None
     continent_label: str | None = None
     mode: str = "mixed"
-    question_message_ids: Dict[int | str, int | None] = field(default_factory=dict)
-    remaining_pairs: List[Dict[str, Any]] = field(default_factory=list)
+    question_message_ids: Dict[str, int | None] = field(default_factory=dict)
+    remaining_pairs: Deque[Dict[str, Any]] = field(default_factory=deque)
     current_pair: Dict[str, Any] | None = None
     turn_index: int = 0
     player_stats: Dict[int, int] = field(default_factory=dict)
+    # Sum of ``player_stats`` values, kept up to date by ``_next_turn``.
+    players_total: int = 0
     bot_team: List[BotParticipant] = field(default_factory=list)
     bot_team_score: int = 0
     turn_order: List[int | str] = field(default_factory=list)
@@ -158,8 +180,23 @@ class CoopSession:
     total_pairs: int = 0
     fact_message_ids: Dict[tuple[int, int], Dict[str, Any]] = field(default_factory=dict)
     fact_message_groups: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # message_id -> key in ``fact_message_ids``, for lookups without a chat id.
+    _fact_keys_by_message_id: Dict[int, tuple[int, int]] = field(
+        default_factory=dict, init=False, repr=False
+    )
     fact_subject: str | None = None
     fact_text: str | None = None
+    # Cached by ``_ensure_turn_setup``; reset whenever players or bots change.
+    _turn_setup_done: bool = field(default=False, init=False, repr=False)
+    _bot_member_index: Dict[str, BotParticipant] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _player_index: Dict[int, int] = field(default_factory=dict, init=False, repr=False)
+    _team_label_html: str = field(default="", init=False, repr=False)
+    # Held from an accepted answer until the turn has advanced.
+    _turn_lock: asyncio.Lock = field(
+        default_factory=asyncio.Lock, init=False, repr=False, compare=False
+    )
 
     @property
     def bot_stats(self) -> int:
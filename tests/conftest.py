@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from bot.ratelimit import limiter  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _reset_rate_limiter():
+    """Keep the shared rate limiter from carrying backlog between tests."""
+
+    limiter.reset()
+    yield
@@ -1,7 +1,7 @@
 import asyncio
 import sys
 from collections.abc import MutableMapping
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import AsyncMock
@@ -511,12 +511,14 @@ def test_invite_stage_generates_link(monkeypatch):
             self.sent = []
             self._username = None
             self._me = SimpleNamespace(username="TestBot")
+            self.get_me_calls = 0
 
         @property
         def username(self):
             return self._username
 
         async def get_me(self):
+            self.get_me_calls += 1
             return self._me
 
         async def send_message(self, chat_id, text, reply_markup=None, parse_mode=None):
@@ -533,6 +535,7 @@ def test_invite_stage_generates_link(monkeypatch):
         bot=bot,
         user_data={"coop_pending": {"session_id": "s1", "stage": "invite"}},
         chat_data={"sessions": {"s1": session}},
+        bot_data={},
     )
 
     replies: list[tuple[str, object]] = []
@@ -561,6 +564,11 @@ def test_invite_stage_generates_link(monkeypatch):
     assert markup is None
     assert context.user_data["coop_pending"]["stage"] == "invite"
 
+    asyncio.run(hco.msg_coop(update, context))
+
+    assert expected_link in replies[1][0]
+    assert bot.get_me_calls == 1
+
 
 @pytest.mark.parametrize(
     "message_payload, expected_target",
@@ -990,3 +998,263 @@ def test_more_fact_handles_duplicate_message_ids(monkeypatch):
     assert not session.fact_message_groups
     assert q_more.answer.await_count == 1
     assert extra_fact.await_count == 1
+
+
+def test_session_index_in_bot_data(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "x")
+    import app  # noqa: F401
+    import bot.handlers_coop as hco
+    from bot.state import CoopSession
+
+    context = SimpleNamespace(chat_data={}, bot_data={})
+    session = CoopSession(session_id="s1")
+    session.players = [1, 2]
+    context.chat_data["sessions"] = {"s1": session}
+    hco._index_session(context, session)
+
+    assert hco._find_session_global(context, "s1") is session
+    assert hco._find_user_session_global(context, 2) == ("s1", session)
+    assert hco._find_user_session_global(context, 3) == (None, None)
+
+    hco._remove_session(context, session)
+    assert hco._find_session_global(context, "s1") is None
+    assert hco._find_user_session_global(context, 1) == (None, None)
+    assert context.bot_data["coop_user_sessions"] == {}
+
+
+def test_correct_answer_reuses_uploaded_flag(monkeypatch, tmp_path):
+    hco, session, context, bot, _ = _setup_session(monkeypatch, continent="Европа")
+
+    flag_file = tmp_path / "flag.png"
+    flag_file.write_bytes(b"fake")
+    monkeypatch.setattr(hco, "get_flag_image_path", lambda *_: flag_file)
+
+    uploads = []
+
+    async def send_photo(chat_id, photo, caption=None, reply_markup=None, parse_mode=None):
+        uploads.append(photo)
+        bot.sent.append((chat_id, caption, reply_markup))
+        return SimpleNamespace(
+            message_id=len(bot.sent),
+            caption=caption,
+            photo=[SimpleNamespace(file_id="small"), SimpleNamespace(file_id="flag-id")],
+        )
+
+    bot.send_photo = send_photo
+    session.current_pair = {"country": "Франция", "capital": "Париж"}
+
+    asyncio.run(hco._broadcast_correct_answer(context, session, "Игрок"))
+    asyncio.run(hco._broadcast_correct_answer(context, session, "Игрок"))
+
+    assert not isinstance(uploads[0], str)
+    assert uploads[1:] == ["flag-id"] * (2 * len(session.players) - 1)
+
+
+def test_launch_game_uses_application_task(monkeypatch):
+    hco, session, context, _, _ = _setup_session(monkeypatch)
+
+    started = []
+
+    async def fake_start_game(ctx, sess):
+        started.append(sess)
+
+    scheduled = []
+
+    def create_task(coro, update=None):
+        scheduled.append((coro, update))
+
+    monkeypatch.setattr(hco, "_start_game", fake_start_game)
+    context.application.create_task = create_task
+    update = SimpleNamespace()
+
+    asyncio.run(hco._launch_game(update, context, session))
+
+    assert not started
+    assert len(scheduled) == 1 and scheduled[0][1] is update
+    asyncio.run(scheduled[0][0])
+    assert started == [session]
+
+
+def test_ask_after_schedules_job_and_skips_cancelled_match(monkeypatch):
+    hco, session, context, _, _ = _setup_session(monkeypatch)
+
+    asked = []
+
+    async def fake_ask(ctx, sess):
+        asked.append(sess)
+
+    class DummyJobQueue:
+        def __init__(self):
+            self.jobs = []
+
+        def get_jobs_by_name(self, name):
+            return []
+
+        def run_once(self, callback, when, data=None, name=None):
+            self.jobs.append((callback, when, data, name))
+
+    monkeypatch.setattr(hco, "_ask_current_pair", fake_ask)
+    job_queue = DummyJobQueue()
+    context.application.job_queue = job_queue
+    context.bot_data = {}
+    hco._index_session(context, session)
+    session.remaining_pairs = [{"country": "Франция", "capital": "Париж"}]
+
+    asyncio.run(hco._ask_after(context, session, 3))
+
+    assert not asked
+    callback, when, data, name = job_queue.jobs[0]
+    assert when == 3 and name == f"coop_turn_{session.session_id}"
+
+    job_context = SimpleNamespace(
+        bot=context.bot, bot_data=context.bot_data, job=SimpleNamespace(data=data)
+    )
+    asyncio.run(callback(job_context))
+    assert asked == [session]
+
+    hco._remove_session(context, session)
+    asyncio.run(callback(job_context))
+    assert asked == [session]
+
+
+def test_repeated_answer_tap_advances_turn_once(monkeypatch):
+    hco, session, context, bot, _ = _setup_session(monkeypatch, continent="Европа")
+    asyncio.run(hco._start_game(context, session))
+    next_turn = AsyncMock()
+    monkeypatch.setattr(hco, "_next_turn", next_turn)
+
+    idx = session.current_pair["options"].index(session.current_pair["correct"])
+
+    def make_update():
+        callback = SimpleNamespace(
+            data=f"coop:ans:{session.session_id}:1:{idx}",
+            answer=AsyncMock(),
+            edit_message_reply_markup=AsyncMock(),
+            message=SimpleNamespace(chat=SimpleNamespace(id=1)),
+        )
+        return SimpleNamespace(callback_query=callback, effective_user=SimpleNamespace(id=1))
+
+    async def tap_twice():
+        await asyncio.gather(
+            hco.cb_coop(make_update(), context), hco.cb_coop(make_update(), context)
+        )
+
+    asyncio.run(tap_twice())
+
+    assert next_turn.await_count == 1
+    assert not session._turn_lock.locked()
+
+
+def test_broadcast_retries_once_after_flood_control(monkeypatch):
+    hco, session, _, _, _ = _setup_session(monkeypatch)
+    attempts = []
+
+    async def send(pid, chat_id):
+        attempts.append(pid)
+        if pid == 1 or attempts.count(pid) == 1:
+            raise hco.RetryAfter(1)
+        return pid
+
+    delivered = asyncio.run(hco._broadcast(session, send, "send failed"))
+
+    assert delivered == [(2, 2, 2)]
+    assert attempts.count(1) == 2 and attempts.count(2) == 2
+
+
+def test_broadcast_skips_long_flood_waits(monkeypatch):
+    hco, session, _, _, _ = _setup_session(monkeypatch)
+    attempts = []
+    sleeps = []
+
+    async def record_sleep(delay, *args, **kwargs):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", record_sleep)
+
+    async def send(pid, chat_id):
+        attempts.append(pid)
+        raise hco.RetryAfter(60)
+
+    delivered = asyncio.run(
+        hco._broadcast(session, send, "send failed", recipients=[1])
+    )
+
+    assert delivered == []
+    assert attempts == [1]
+    assert 60 not in sleeps
+    wait = SimpleNamespace(retry_after=timedelta(seconds=2))
+    assert hco._retry_after_seconds(wait) == 2.0
+
+
+def test_broadcast_retries_network_errors_but_not_timeouts(monkeypatch):
+    hco, session, _, _, _ = _setup_session(monkeypatch)
+    attempts = []
+
+    session.players.append(3)
+    session.player_chats[3] = 3
+
+    async def send(pid, chat_id):
+        attempts.append(pid)
+        if pid == 1:
+            raise hco.TimedOut()
+        if pid == 3:
+            raise hco.BadRequest("Chat not found")
+        if attempts.count(pid) == 1:
+            raise hco.NetworkError("connection reset")
+        return pid
+
+    delivered = asyncio.run(hco._broadcast(session, send, "send failed"))
+
+    assert delivered == [(2, 2, 2)]
+    assert attempts.count(1) == 1 and attempts.count(2) == 2
+    assert attempts.count(3) == 1
+
+
+def test_foreign_tap_does_not_leave_session_in_outsider_chat(monkeypatch):
+    hco, session, context, _, _ = _setup_session(monkeypatch, continent="Европа")
+    outsider_chat_data = {"sessions": {}}
+    context.application.chat_data[99] = outsider_chat_data
+    outsider_context = SimpleNamespace(
+        bot=context.bot,
+        chat_data=outsider_chat_data,
+        application=context.application,
+    )
+    callback = SimpleNamespace(
+        data=f"coop:ans:{session.session_id}:1:0",
+        answer=AsyncMock(),
+        message=SimpleNamespace(chat=SimpleNamespace(id=99)),
+    )
+    update = SimpleNamespace(
+        callback_query=callback, effective_user=SimpleNamespace(id=99)
+    )
+    session.current_pair = {"options": ["a"], "correct": "a"}
+
+    asyncio.run(hco.cb_coop(update, outsider_context))
+    hco._remove_session(context, session)
+
+    assert outsider_chat_data["sessions"] == {}
+
+
+def test_rejected_join_does_not_leave_session_in_outsider_chat(monkeypatch):
+    hco, session, context, _, _ = _setup_session(monkeypatch)
+    outsider_chat_data = {}
+    context.application.chat_data[99] = outsider_chat_data
+    reply_text = AsyncMock()
+    outsider_context = SimpleNamespace(
+        bot=context.bot,
+        args=[session.session_id],
+        chat_data=outsider_chat_data,
+        user_data={},
+        application=context.application,
+    )
+    update = SimpleNamespace(
+        message=SimpleNamespace(reply_text=reply_text),
+        effective_chat=SimpleNamespace(id=99, type="private"),
+        effective_user=SimpleNamespace(id=99),
+    )
+
+    asyncio.run(hco.cmd_coop_join(update, outsider_context))
+    hco._remove_session(context, session)
+
+    reply_text.assert_awaited_once_with("В матче уже хватает игроков")
+    assert outsider_chat_data["sessions"] == {}
@@ -40,6 +40,7 @@ def test_cards_more_fact(monkeypatch):
 
         message = SimpleNamespace(
             message_id=1,
+            chat_id=1,
             text="Интересный факт: old\n\nНажми кнопку ниже, чтобы узнать еще один факт",
             caption=None,
             photo=None,
@@ -90,3 +91,23 @@ def test_generate_llm_fact_handles_list_content(monkeypatch):
         assert fact == "fact1 fact2"
 
     asyncio.run(run())
+
+
+def test_generate_llm_fact_reuses_recent_answer(monkeypatch):
+    async def run():
+        resp = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="fact"))]
+        )
+        create = AsyncMock(return_value=resp)
+        fake_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+        monkeypatch.setattr(bot.facts, "_client", fake_client)
+        monkeypatch.setattr(bot.facts, "_llm_cache", bot.facts.OrderedDict())
+        assert await bot.facts.generate_llm_fact("Перу", "old") == "fact"
+        assert await bot.facts.generate_llm_fact("Перу", "old") == "fact"
+        assert create.await_count == 1
+        await bot.facts.generate_llm_fact("Перу", "other")
+        assert create.await_count == 2
+
+    asyncio.run(run())
@@ -5,10 +5,18 @@ from pathlib import Path
 # add project root to path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from bot.flags import get_country_flag  # noqa: E402
+from bot.flags import get_country_flag, read_flag_image  # noqa: E402
 
 
 def test_all_countries_have_flag():
     data = json.loads(Path('data/capitals.json').read_text(encoding='utf-8'))
     missing = [c for c in data['capital_by_country'] if not get_country_flag(c)]
     assert not missing, f"Missing flags for: {missing}"
+
+
+def test_read_flag_image_is_cached(tmp_path):
+    flag = tmp_path / "xx_flag.png"
+    flag.write_bytes(b"first")
+    assert read_flag_image(str(flag)) == b"first"
+    flag.write_bytes(b"second")
+    assert read_flag_image(str(flag)) == b"first"
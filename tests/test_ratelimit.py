@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from bot.ratelimit import RateLimiter  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_per_chat_burst_then_throttled():
+    clock = FakeClock()
+    limiter = RateLimiter(global_rps=30, per_chat_rps=1, per_chat_burst=3, clock=clock)
+    delays = [limiter.reserve(1) for _ in range(5)]
+    assert delays[:3] == [0.0, 0.0, 0.0]
+    assert delays[3] == 1.0
+    assert delays[4] == 2.0
+    # Other chats are not affected by chat 1's backlog.
+    assert limiter.reserve(2) == 0.0
+    clock.now = 10.0
+    assert limiter.reserve(1) == 0.0
+
+
+def test_global_bucket_limits_all_chats():
+    clock = FakeClock()
+    limiter = RateLimiter(global_rps=2, per_chat_rps=1, per_chat_burst=3, clock=clock)
+    assert limiter.reserve(1) == 0.0
+    assert limiter.reserve(2) == 0.0
+    assert limiter.reserve(None) == 0.5